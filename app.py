@@ -1,19 +1,31 @@
 import streamlit as st
 from streamlit_ace import st_ace
-import time
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import logging
 import os
+import time
 import pandas as pd
-from shroomdk import ShroomDK
-from transpose import Transpose
-import requests
-import json
-import math
-import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib.dates as md
-import matplotlib.ticker as ticker
-import numpy as np
-import plotly.express as px
+from query_osmosis.cache import fetch_query
+from query_osmosis.cassette import cassette_sdk
+from query_osmosis.flipside import FlipsideProvider
+from query_osmosis.interning import decode_frame
+from query_osmosis.local import (
+    LOCAL_MAX_AGE,
+    LOCAL_TIMEOUT,
+    DuckDBProvider,
+    duckdb_available,
+)
+from query_osmosis.mars import mars_tvl
+from query_osmosis.materialize import MaterializingProvider
+from query_osmosis.metrics import serve, snapshot, timed
+from query_osmosis.providers import register_provider, run_query
+from query_osmosis.queries import render, semantic_sql
+from query_osmosis.refresher import Refresher
+from query_osmosis.results import result_store_from_env
+from query_osmosis.schema import schema_tables
+from query_osmosis.shared_cache import shared_cache_from_env
+from query_osmosis.staking import StakingLedger
 
 # Configure Streamlit Page
 #page_icon = "assets/img/eth.jpg"
@@ -25,55 +37,229 @@ st.warning(
     "Quickly explore Osmosis blockchain data. For extensive usage, register directly with Flipside, using an amazing guide made by Cordtus [here](https://hackmd.io/@ILT-2i1MSgCJAtK6mNy40Q/SyLjS7UW3). The following tool will be on the top side at all times for users to interact better with the queries."
 )
 
-# Get API Keys
-flipside_key = st.secrets["API_KEY"]
-sdk = ShroomDK(flipside_key)
-
-# Query Flipside using their Python SDK
-def query_flipside(q):
-    sdk = ShroomDK(flipside_key)
-    result_list = []
-    for i in range(1, 11):  # max is a million rows @ 100k per page
-        data = sdk.query(q, page_size=100000, page_number=i)
-        if data.run_stats.record_count == 0:
-            break
-        else:
-            result_list.append(data.records)
-    result_df = pd.DataFrame()
-    for idx, each_list in enumerate(result_list):
-        if idx == 0:
-            result_df = pd.json_normalize(each_list)
-        else:
-            try:
-                result_df = pd.concat([result_df, pd.json_normalize(each_list)])
-            except:
-                continue
-    result_df.drop(columns=["__row_index"], inplace=True)
-    return result_df
-
-
-
-# Provider names mapped to their respective query functions
-def run_query(q, provider):
-    provider_query = {
-        "Flipside": query_flipside
-    }
-    df = provider_query[provider](q)
-    return df
-    
-ace_query = st_ace(
-    language="sql",
-    placeholder="select * from osmosis.core.fact_transfers limit 10",
-    theme="twilight",
+# Get API Keys. FLIPSIDE_CASSETTE=record:<path> saves every response to a
+# cassette and replay:<path> serves them back offline, without an API key.
+# FLIPSIDE_FAKE=<seconds> serves synthetic results with that much latency per
+# query instead, for load tests (benchmarks/loadtest.py).
+# One client per process, built (and shroomdk imported) on the first query.
+@st.cache_resource
+def get_sdk():
+    if os.environ.get("FLIPSIDE_FAKE"):
+        from query_osmosis.fake import FakeShroomDK, app_default, app_responses
+
+        return FakeShroomDK(
+            app_responses(),
+            app_default,
+            latency=float(os.environ["FLIPSIDE_FAKE"]),
+        )
+
+    def connect():
+        from shroomdk import ShroomDK
+
+        return ShroomDK(st.secrets["API_KEY"])
+
+    return cassette_sdk(os.environ.get("FLIPSIDE_CASSETTE"), connect)
+
+
+DASHBOARD_REFRESH = int(os.environ.get("DASHBOARD_REFRESH", "900"))  # seconds
+
+
+# Queries go to the local DuckDB copy of the Osmosis tables under
+# LOCAL_DATA_DIR when it has every table a query reads, copied within the last
+# LOCAL_MAX_AGE seconds (python -m query_osmosis.local). Otherwise queries with
+# CTEs the editor runs again within one dashboard refresh period run those on
+# Flipside once and the rest locally (see query_osmosis/materialize.py), and
+# anything else goes to Flipside.
+@st.cache_resource
+def init_providers():
+    flipside = FlipsideProvider(connect=get_sdk)
+    if duckdb_available():
+        root = os.environ.get("LOCAL_DATA_DIR", "data")
+        max_age = float(os.environ.get("LOCAL_MAX_AGE", LOCAL_MAX_AGE))
+        timeout = float(os.environ.get("LOCAL_TIMEOUT", LOCAL_TIMEOUT))
+        register_provider(DuckDBProvider(root, max_age, timeout))
+        register_provider(MaterializingProvider(root, flipside, DASHBOARD_REFRESH))
+    register_provider(flipside)
+
+
+init_providers()
+
+# Prometheus metrics on http://127.0.0.1:<METRICS_PORT>/metrics, 0 disables.
+# Each worker on a host needs its own METRICS_PORT; a worker whose port is
+# taken logs a warning and serves no metrics.
+@st.cache_resource
+def serve_metrics(port):
+    if not serve(port):
+        logging.getLogger(__name__).warning(
+            "METRICS_PORT %d is in use, metrics of this worker (pid %d) are not"
+            " served; give each worker its own port",
+            port,
+            os.getpid(),
+        )
+
+
+metrics_port = int(os.environ.get("METRICS_PORT", "9464"))
+if metrics_port:
+    serve_metrics(metrics_port)
+
+RESULT_TTL = 1000000
+
+# Query results and figures shared by every worker on the host, configured by
+# SHARED_CACHE_URL (sqlite:///<path> or redis://<host>); off when unset.
+@st.cache_resource
+def get_shared_cache():
+    return shared_cache_from_env()
+
+
+# The dashboard datasets, reloaded every DASHBOARD_REFRESH seconds by a
+# background thread instead of on script runs (see query_osmosis/refresher.py).
+# A reload goes through the shared cache under the current refresh period, so
+# the workers of a host run each query once per period.
+@st.cache_resource
+def get_refresher():
+    refresher = Refresher(DASHBOARD_REFRESH)
+
+    def fetch(key, sql):
+        def run():
+            with timed("compute"):
+                return run_query(sql)
+
+        period = int(time.time() // DASHBOARD_REFRESH)
+        return get_shared_cache().frame(
+            f"{key}@{period}", run, ttl=2 * DASHBOARD_REFRESH
+        )
+
+    refresher.add(
+        "ibc_transfers_daily",
+        lambda: fetch_query("ibc_transfers_daily", fetch, days=30),
+    )
+    refresher.add(
+        "staking_daily",
+        lambda: fetch_query("staking_daily", fetch, days=30, currency="uosmo"),
+    )
+    # Run in long format and pivot locally; see query_osmosis/mars.py
+    def load_mars_tvl():
+        flows = fetch_query("mars_flows", fetch)
+        with timed("mars_tvl"):
+            return mars_tvl(flows)
+
+    refresher.add("mars_tvl", load_mars_tvl)
+    refresher.start()
+    return refresher
+
+
+# Delegation balances for the staking ranking, kept up to date from a
+# background thread by reading only new staking events (see
+# query_osmosis/staking.py). It starts when the ranking is first shown. The
+# snapshot under LOCAL_DATA_DIR lets a restarted worker carry on from its last
+# block, and with a shared cache the workers of a host take turns under its
+# lock, so one of them reads the events and the others load its snapshot.
+STAKING_LEDGER = os.path.join(
+    os.environ.get("LOCAL_DATA_DIR", "data"), "staking_ledger.parquet"
 )
+STAKING_REFRESH = 600  # seconds
+STAKING_LOCK_TTL = 3600  # seconds the first, full read of the events may take
+
+
+@st.cache_resource
+def get_staking_ledger():
+    ledger = StakingLedger.load(STAKING_LEDGER)
+    ledger.start(
+        run_query,
+        STAKING_REFRESH,
+        STAKING_LEDGER,
+        lock=lambda: get_shared_cache().lock(
+            "staking_ledger", ttl=STAKING_LOCK_TTL, wait=STAKING_LOCK_TTL
+        ),
+    )
+    return ledger
+
+
+# Build a chart, or load it from the shared cache when another worker already
+# built it from the same data (`data_key`, e.g. the query it plots).
+def figure(name, data_key, build):
+    shared_cache = get_shared_cache()
+    with timed("figure", chart=name):
+        if shared_cache.backend is None:
+            return build()
+        import plotly.io as pio
+
+        payload = shared_cache.get_or_fill(
+            f"figure:{name}:{data_key}",
+            lambda: build().to_json().encode(),
+            ttl=RESULT_TTL,
+        )
+        return pio.from_json(payload.decode())
+
+
+# Editor results, shared by sessions running semantically equal queries and
+# kept within the RESULT_*_MB memory budgets, spilling to disk past them (see
+# query_osmosis/results.py). Results are rerun after RESULT_TTL_S seconds, and
+# only the first DISPLAY_ROWS rows of a result are sent to the browser.
+DISPLAY_ROWS = 50000
+
+
+@st.cache_resource
+def get_result_store():
+    return result_store_from_env()
+
+
+def session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+
+def plot(name, fig):
+    with timed("plotly_chart", chart=name):
+        st.plotly_chart(fig, theme="streamlit", use_container_width=True)
+
+
+# A chart per dataset version, kept in this process so a rerun that finds the
+# same version sends the chart it already has instead of building it again.
+# Versions are content hashes, so the shared cache key is the same in every
+# worker for the same data. The chart builders import plotly themselves, so it
+# is only loaded once a chart has to be built.
+@st.cache_resource(max_entries=32, show_spinner=False)
+def dashboard_figure(name, dataset, version, _build):
+    return figure(name, f"{dataset}@{version}", _build)
+
+
+# A query editor with its result. A fragment, so typing a query reruns only
+# this editor.
+@st.fragment
+def editor(placeholder, key):
+    ace_query = st_ace(
+        language="sql",
+        placeholder=placeholder,
+        theme="twilight",
+        key=key,
+    )
 
-provider_0 = 'Flipside'
-try:
-    if ace_query:
-        results_df = run_query(ace_query, provider_0)
-        st.write(results_df)
-except:
-    st.write("Write a new query.")
+    provider_0 = 'auto'
+    try:
+        if ace_query:
+            result_store = get_result_store()
+            result_store.forget_sessions(Runtime.instance().is_active_session)
+            result_key = semantic_sql(ace_query)
+            result = result_store.get(session_id(), result_key)
+            if result is None:
+                result = run_query(
+                    ace_query,
+                    provider_0,
+                    collect=lambda pages: result_store.collect(
+                        session_id(), result_key, pages
+                    ),
+                )
+            st.write(result.head(DISPLAY_ROWS))
+            if result.rows > DISPLAY_ROWS:
+                st.caption(
+                    f"Showing the first {DISPLAY_ROWS:,} of {result.rows:,} rows."
+                )
+    except:
+        st.write("Write a new query.")
+
+
+editor("select * from osmosis.core.fact_transfers limit 10", "editor")
     
 st.warning("Please, when using the tool and querying, use simple queries and limit 10 to reduce the querying time, since it is limited!")
         
@@ -95,54 +281,18 @@ provider = st.sidebar.selectbox("Schema", ["Osmosis core tables"])
 st.sidebar.write("Tables")
 
 # Render the Query Editor
-provider_schema_df = schema_df[schema_df["table_schema"] == 'core']
-provider_tables_df = (
-    provider_schema_df.drop(columns=["column_name"])
-    .drop_duplicates()
-    .sort_values(by=["table_name"])
-)
-
-for index, row in provider_tables_df.iterrows():
-    table_name = row["table_name"]
-    table_schema = row["table_schema"]
-    table_catalog = row["table_catalog"]
-    if str(table_catalog) != "nan":
-        table_catalog = f"{table_catalog}."
-    else:
-        table_catalog = ""
-
+for table_name, qualified_name, columns_df in schema_tables(schema_df, "core"):
     with st.sidebar.expander(table_name):
-        st.code(f"{table_catalog}{table_schema}.{table_name}", language="sql")
-        columns_df = provider_schema_df[provider_schema_df["table_name"] == table_name][
-            ["column_name"]
-        ]
+        st.code(qualified_name, language="sql")
         st.table(columns_df)
 
 provider_2 = st.sidebar.selectbox("Schema", ["Mars tables on Osmosis"])
 st.sidebar.write("Tables")
 
 # Render the Query Editor
-provider_schema_df_2 = schema_df[schema_df["table_schema"] == 'mars']
-provider_tables_df_2 = (
-    provider_schema_df_2.drop(columns=["column_name"])
-    .drop_duplicates()
-    .sort_values(by=["table_name"])
-)
-
-for index, row in provider_tables_df_2.iterrows():
-    table_name = row["table_name"]
-    table_schema = row["table_schema"]
-    table_catalog = row["table_catalog"]
-    if str(table_catalog) != "nan":
-        table_catalog = f"{table_catalog}."
-    else:
-        table_catalog = ""
-
+for table_name, qualified_name, columns_df in schema_tables(schema_df, "mars"):
     with st.sidebar.expander(table_name):
-        st.code(f"{table_catalog}{table_schema}.{table_name}", language="sql")
-        columns_df = provider_schema_df_2[provider_schema_df_2["table_name"] == table_name][
-            ["column_name"]
-        ]
+        st.code(qualified_name, language="sql")
         st.table(columns_df)
 
 
@@ -307,67 +457,53 @@ with tab3:
     st.write('')
     st.write('Now that we have all the tools needed, we can start querying. We will look at a couple of examples, starting with transfers, both IBC transfers and non-IBC transfers')
     
-    code5 = '''select distinct transfer_type from osmosis.core.fact_transfers
-    ''' 
+    code5 = render("transfer_types")
 
     st.code(code5, language="sql", line_numbers=False)            
     
     st.write('The code above shows the different types of transfers. We can execute it below, and see what it returns.')
     # Query Editor
-    ace_query = st_ace(
-        language="sql",
-        placeholder="select distinct transfer_type from osmosis.core.fact_transfers",
-        theme="twilight",
-    )  
+    editor(
+        "select distinct transfer_type from osmosis.core.fact_transfers",
+        "transfer_types_editor",
+    )
     
         
     st.write('So it returns three values: IBC_TRANSFER_OUT, IBC_TRANSFER_IN and OSMOSIS. Therefore, the two first values correspond to tokens being sent out and received to and from other IBC-enabled blockchains. Consider the following code:')
 
 
-    code6 = '''select date_trunc('day', block_timestamp) as date,
-    transfer_type,
-    count(distinct tx_id) as num_tx from osmosis.core.fact_transfers a 
-    where tx_succeeded = 'TRUE'
-    and  date_trunc('day', block_timestamp) >= current_date - 30
-    and transfer_type in ('IBC_TRANSFER_IN','IBC_TRANSFER_OUT')
-    group by date, transfer_type
-    ''' 
+    code6 = render("ibc_transfers_daily", days=30)
 
     st.code(code6, language="sql", line_numbers=False)            
     
     st.write('If we execute and plot the results of the previous statement, we can plot the daily number of IBC transactions in and out of Osmosis from the past 30 days.')
-   
-    
-    sql0 = """
-       select date_trunc('day', block_timestamp) as date,
-    transfer_type,
-    count(distinct tx_id) as num_tx from osmosis.core.fact_transfers a 
-    where tx_succeeded = 'TRUE'
-    and  date_trunc('day', block_timestamp) >= current_date - 30
-    and transfer_type in ('IBC_TRANSFER_IN','IBC_TRANSFER_OUT')
-    group by date, transfer_type
-
-    
-    """
-    
-    st.experimental_memo(ttl=1000000)
-    @st.experimental_memo
-    def compute(a):
-        results=sdk.query(a)
-        return results
-    
-    results0 = compute(sql0)
-    df0 = pd.DataFrame(results0.records)
-    
-    fig1 = px.bar(df0, x="date", y="num_tx", color="transfer_type", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily number of IBC transactions - last 30 days',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14,
-    bargap=0.15, # gap between bars of adjacent location coordinates.
-    bargroupgap=0.1 # gap between bars of the same location coordinate.
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
+
+    # Chart sections are fragments: they rerun on their own every
+    # DASHBOARD_REFRESH seconds to pick up a new dataset version, and the rest
+    # of the page does not rerun their queries or charts
+    @st.fragment(run_every=DASHBOARD_REFRESH)
+    def ibc_transfers():
+        version, df0 = get_refresher().get("ibc_transfers_daily")
+    
+        def ibc_chart():
+            import plotly.express as px
+
+            fig1 = px.bar(df0, x="date", y="num_tx", color="transfer_type", color_discrete_sequence=px.colors.qualitative.Pastel2)
+            fig1.update_layout(
+            title='Daily number of IBC transactions - last 30 days',
+            xaxis_tickfont_size=14,
+            yaxis_tickfont_size=14,
+            bargap=0.15, # gap between bars of adjacent location coordinates.
+            bargroupgap=0.1 # gap between bars of the same location coordinate.
+            )
+            return fig1
+
+        fig = dashboard_figure(
+            "ibc_transfers", "ibc_transfers_daily", version, ibc_chart
+        )
+        plot("ibc_transfers", fig)
+
+    ibc_transfers()
  
       
     st.subheader("Daily amount delegated/undelegated/redelegated")
@@ -376,48 +512,33 @@ with tab3:
     
 
 
-    code7 = '''select date_trunc('day', block_timestamp) as date,
-    action,
-    sum(amount/pow(10, decimal)) as total_amount from osmosis.core.fact_staking a 
-    where tx_succeeded = 'TRUE'
-    and  date_trunc('day', block_timestamp) >= current_date - 30
-    and currency = 'uosmo'
-    group by date, action
-    ''' 
+    code7 = render("staking_daily", days=30, currency="uosmo")
 
     st.code(code7, language="sql", line_numbers=False)            
     
     st.write('If we execute and plot the results of the previous statement, we can plot the daily number of IBC transactions in and out of Osmosis from the past 30 days.')
-   
-    
-    sql1 = """
-       select date_trunc('day', block_timestamp) as date,
-    action,
-    sum(amount/pow(10, decimal)) as total_amount from osmosis.core.fact_staking a 
-    where tx_succeeded = 'TRUE'
-    and  date_trunc('day', block_timestamp) >= current_date - 30
-    and currency = 'uosmo'
-    group by date, action   
-    """
-    
-    st.experimental_memo(ttl=1000000)
-    @st.experimental_memo
-    def compute(a):
-        results=sdk.query(a)
-        return results
-    
-    results1 = compute(sql1)
-    df1 = pd.DataFrame(results1.records)
-    
-    fig1 = px.bar(df1, x="date", y="total_amount", color="action", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily OSMO delegated, undelegated and redelegated - last 30 days',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14,
-    bargap=0.15, # gap between bars of adjacent location coordinates.
-    bargroupgap=0.1 # gap between bars of the same location coordinate.
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
+
+    @st.fragment(run_every=DASHBOARD_REFRESH)
+    def staking_daily():
+        version, df1 = get_refresher().get("staking_daily")
+    
+        def staking_chart():
+            import plotly.express as px
+
+            fig1 = px.bar(df1, x="date", y="total_amount", color="action", color_discrete_sequence=px.colors.qualitative.Pastel2)
+            fig1.update_layout(
+            title='Daily OSMO delegated, undelegated and redelegated - last 30 days',
+            xaxis_tickfont_size=14,
+            yaxis_tickfont_size=14,
+            bargap=0.15, # gap between bars of adjacent location coordinates.
+            bargroupgap=0.1 # gap between bars of the same location coordinate.
+            )
+            return fig1
+
+        fig = dashboard_figure("staking_daily", "staking_daily", version, staking_chart)
+        plot("staking_daily", fig)
+
+    staking_daily()
  
     
 with tab4:    
@@ -442,575 +563,76 @@ with tab4:
     st.write('With this concepts introduced, we can now go finally one step further, and create a complex query which gives you the amount staked per address.')
     
     
-    code9 = '''WITH time as (
-    select
-      max(date_trunc('day', block_timestamp)) as date
-    from
-      osmosis.core.fact_blocks 
-  ),
-  delegations as (
-    select
-      date_trunc('day', block_timestamp) as date,
-      delegator_address,
-      validator_address,
-      sum(amount / pow(10, decimal)) as amount
-    from
-      osmosis.core.fact_staking
-    where
-      tx_succeeded = 'TRUE'
-      and action = 'delegate'
-      and date_trunc('day', block_timestamp) <= (
-        select
-          date
-        from
-          time
-      )
-    group by
-      date,
-      delegator_address,
-      validator_address
-  ),
-  undelegations as (
-    select
-      date_trunc('day', block_timestamp) as date,
-      delegator_address,
-      validator_address,
-      sum(amount / pow(10, decimal)) * (-1) as amount
-    from
-      osmosis.core.fact_staking
-    where
-      tx_succeeded = 'TRUE'
-      and action = 'undelegate'
-      and date_trunc('day', block_timestamp) <= (
-        select
-          date
-        from
-          time
-      )
-    group by
-      date,
-      delegator_address,
-      validator_address
-  ),
-  redelegations_to as (
-    select
-      date_trunc('day', block_timestamp) as date,
-      delegator_address,
-      validator_address,
-      sum(amount / pow(10, decimal)) as amount
-    from
-      osmosis.core.fact_staking
-    where
-      tx_succeeded = 'TRUE'
-      and action = 'redelegate'
-      and date_trunc('day', block_timestamp) <= (
-        select
-          date
-        from
-          time
-      )
-    group by
-      date,
-      delegator_address,
-      validator_address
-  ),
-  redelegations_from as (
-    select
-      date_trunc('day', block_timestamp) as date,
-      delegator_address,
-      redelegate_source_validator_address as validator_address,
-      sum(amount / pow(10, decimal)) * (-1) as amount
-    from
-      osmosis.core.fact_staking
-    where
-      tx_succeeded = 'TRUE'
-      and action = 'redelegate'
-      and date_trunc('day', block_timestamp) <= (
-        select
-          date
-        from
-          time
-      )
-    group by
-      date,
-      delegator_address,
-      redelegate_source_validator_address
-  ),
-  total_staked_user_1 as (
-    select
-      delegator_address,
-      b.total_amount,
-      sum(amount) as amount_delegated_user,
-      amount_delegated_user / b.total_amount * 100 as percentage_over_total,
-      rank() over (
-        order by
-          percentage_over_total desc
-      ) as rank
-    from
-      (
-        select
-          *
-        from
-          delegations
-        union all
-        select
-          *
-        from
-          undelegations
-        union all
-        select
-          *
-        from
-          redelegations_to
-        union all
-        select
-          *
-        from
-          redelegations_from
-      ) a
-      join (
-        select
-          sum(amount) as total_amount
-        from
-          (
-            select
-              *
-            from
-              delegations
-            union all
-            select
-              *
-            from
-              undelegations
-            union all
-            select
-              *
-            from
-              redelegations_to
-            union all
-            select
-              *
-            from
-              redelegations_from
-          )
-      ) b
-    group by
-      1,
-      2
-    order by
-      percentage_over_total desc
-  )
-select * from total_staked_user_1
-limit 20
-    ''' 
+    code9 = render("staking_share")
     st.code(code9, language="sql", line_numbers=False)       
     
     st.write('So yeah that is a large query. It takes the last available date, delegations, undelegations, redelegations from and redelegations to other validators, and finally calculates the percentage each user has over the total amount staked, and assigns a rank based on that order. I have set a limit to only show the first 20 rows, but feel free to erase that in order to have a full list. Even more, if you select a specific date in the first CTE, it will show the amount staked by each user on that specific date.')
 
+    # Changing the inputs here reruns only this section
+    @st.fragment
+    def top_delegators():
+        if st.checkbox("Show the current top delegators"):
+            ledger = get_staking_ledger()
+            if ledger.updated is None:
+                st.info("The delegation ledger is still reading staking events.")
+                return
+            top_n = st.number_input("Number of delegators", 1, 1000, 20)
+            with timed("staking_top"):
+                st.dataframe(decode_frame(ledger.top(top_n)))
+            address = st.text_input("Rank of a delegator address")
+            if address:
+                st.write(ledger.rank(address) or "No staking events for this address")
+
+    top_delegators()
+
     st.write('')
     st.write('Another nice and interesting query is the one below, using [Effort Capital dashboard](https://flipsidecrypto.xyz/effortcapital1/mars-osmosis-outpost-naeBDD) on Mars Outpost on Osmosis:')
     
         
-    code13 = '''with txs as (
-select
-distinct a.tx_id,
-a.msg_group,
-action
-from (
-select
-tx_id,
-msg_group,
-attribute_value as action
-from osmosis.core.fact_msg_attributes
-where attribute_key = 'action' and 
-(attribute_value = 'borrow' or attribute_value = 'deposit' or attribute_value = 'withdraw' or attribute_value = 'repay'
-)) a
-left join osmosis.core.fact_msg_attributes b
-on a.tx_id = b.tx_id
-where b.attribute_key = '_contract_address' and b.attribute_value = 'osmo1c3ljch9dfw5kf52nfwpxd2zmj2ese7agnx0p9tenkrryasrle5sqf3ftpg'
-),
-
-asset_flows as (
-
-select distinct *
-
-from (
-
-select
-date_trunc('hour',a.block_timestamp) as dt,
-a.tx_id,
-b.action,
-d.token as asset,
-a.amount/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount,
-a.amount*e.price/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount_usd
-from (
-select
-block_timestamp,
-tx_id,
-msg_group,
-attribute_value as amount
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm' and attribute_key = 'amount_scaled'
-) a
-join txs b
-on a.tx_id = b.tx_id and a.msg_group = b.msg_group
-join (
-select
-tx_id,
-msg_group,
-attribute_value as denom
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm-interests_updated' and attribute_key = 'denom'
-) c
-on a.tx_id = c.tx_id and a.msg_group = c.msg_group
-join (
-select
-address,
-upper(project_name) as token,
-decimal
-from osmosis.core.dim_tokens
-) d 
-on c.denom = d.address
-join (
-select 
-recorded_hour,
-symbol,
-price
-from osmosis.core.ez_prices
-) e 
-on d.token = e.symbol and date_trunc('hour',a.block_timestamp) = e.recorded_hour
-join (
-select
-tx_id,
-msg_group,
-attribute_value as liquidity_index
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm-interests_updated' and attribute_key = 'liquidity_index'
-) f
-on a.tx_id = f.tx_id and a.msg_group = f.msg_group
-where e.recorded_hour is not null
-)
-),
-
-summarized_flows as (
-
-select 
-  dt,
-  sum(coalesce(case when action = 'deposit' and asset = 'OSMO' then amount end,0)) as Deposited_OSMO,
-  sum(coalesce(case when action = 'deposit' and asset = 'ATOM' then amount end,0)) as Deposited_ATOM,
-  sum(coalesce(case when action = 'deposit' and asset = 'USDC' then amount end,0)) as Deposited_USDC,
-  sum(coalesce(case when action = 'deposit' and asset = 'STATOM' then amount end,0)) as Deposited_stATOM,
-  sum(coalesce(case when action = 'borrow' and asset = 'OSMO' then amount end,0)) as Borrowed_OSMO,
-  sum(coalesce(case when action = 'borrow' and asset = 'ATOM' then amount end,0)) as Borrowed_ATOM,
-  sum(coalesce(case when action = 'borrow' and asset = 'USDC' then amount end,0)) as Borrowed_USDC,
-  sum(coalesce(case when action = 'borrow' and asset = 'STATOM' then amount end,0)) as Borrowed_stATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'OSMO' then amount end,0)) as Withdrawn_OSMO,
-  sum(coalesce(case when action = 'withdraw' and asset = 'ATOM' then amount end,0)) as Withdrawn_ATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'STATOM' then amount end,0)) as Withdrawn_stATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'USDC' then amount end,0)) as Withdrawn_USDC,
-  sum(coalesce(case when action = 'repay' and asset = 'OSMO' then amount end,0)) as Repaid_OSMO,
-  sum(coalesce(case when action = 'repay' and asset = 'ATOM' then amount end,0)) as Repaid_ATOM,
-  sum(coalesce(case when action = 'repay' and asset = 'USDC' then amount end,0)) as Repaid_USDC,
-  sum(coalesce(case when action = 'repay' and asset = 'STATOM' then amount end,0)) as Repaid_stATOM,
-  SUM(Deposited_OSMO) over (order by dt asc) as Cum_Deposit_OSMO,
-  SUM(Borrowed_OSMO) over (order by dt asc) as Cum_Borrowed_OSMO,
-  SUM(Withdrawn_OSMO) over (order by dt asc) as Cum_Withdrawn_OSMO,
-  SUM(Repaid_OSMO) over (order by dt asc) as Cum_Repaid_OSMO,
-  SUM(Deposited_ATOM) over (order by dt asc) as Cum_Deposit_ATOM,
-  SUM(Borrowed_ATOM) over (order by dt asc) as Cum_Borrowed_ATOM,
-  SUM(Withdrawn_ATOM) over (order by dt asc) as Cum_Withdrawn_ATOM,
-  SUM(Repaid_ATOM) over (order by dt asc) as Cum_Repaid_ATOM,
-  SUM(Deposited_USDC) over (order by dt asc) as Cum_Deposit_USDC,
-  SUM(Borrowed_USDC) over (order by dt asc) as Cum_Borrowed_USDC,
-  SUM(Withdrawn_USDC) over (order by dt asc) as Cum_Withdrawn_USDC,
-  SUM(Repaid_USDC) over (order by dt asc) as Cum_Repaid_USDC,
-  SUM(Deposited_stATOM) over (order by dt asc) as Cum_Deposit_stATOM,
-  SUM(Borrowed_stATOM) over (order by dt asc) as Cum_Borrowed_stATOM,
-  SUM(Withdrawn_stATOM) over (order by dt asc) as Cum_Withdrawn_stATOM,
-  SUM(Repaid_stATOM) over (order by dt asc) as Cum_Repaid_stATOM
-from asset_flows
-group by 1
-order by 1 asc
-
-)
-
-select 
-a.*,
-coalesce((cum_deposit_OSMO-cum_withdrawn_OSMO)*OSMO_price,0) as OSMO_Deposit_TVL,
-coalesce((cum_deposit_ATOM-cum_withdrawn_ATOM)*ATOM_price,0) as ATOM_Deposit_TVL,
-coalesce((cum_deposit_stATOM-cum_withdrawn_stATOM)*stATOM_price,0) as stATOM_Deposit_TVL,
-coalesce((cum_deposit_USDC-cum_withdrawn_USDC)*USDC_price,0) as USDC_Deposit_TVL,
-coalesce((cum_borrowed_OSMO-cum_repaid_OSMO)*OSMO_price,0) as OSMO_Borrowed_TVL,
-coalesce((cum_borrowed_ATOM-cum_repaid_ATOM)*ATOM_price,0) as ATOM_Borrowed_TVL,
-coalesce((cum_borrowed_USDC-cum_repaid_USDC)*USDC_price,0) as USDC_Borrowed_TVL,
-coalesce((cum_borrowed_stATOM-cum_repaid_stATOM)*stATOM_price,0) as stATOM_Borrowed_TVL,
-OSMO_Deposit_TVL+ATOM_Deposit_TVL+USDC_Deposit_TVL+stATOM_Deposit_TVL as Deposit_TVL,
-OSMO_Borrowed_TVL+ATOM_Borrowed_TVL+USDC_Borrowed_TVL+stATOM_Borrowed_TVL as Borrow_TVL,
-Deposit_TVL - Borrow_TVL as Total_TVL,
-OSMO_Deposit_TVL-OSMO_Borrowed_TVL as OSMO_TVL,
-ATOM_Deposit_TVL-ATOM_Borrowed_TVL as ATOM_TVL,
-USDC_Deposit_TVL-USDC_Borrowed_TVL as USDC_TVL,
-stATOM_Deposit_TVL-stATOM_Borrowed_TVL as stATOM_TVL,
-case when OSMO_Deposit_TVL=0 then 0 else OSMO_Borrowed_TVL/OSMO_Deposit_TVL end as OSMO_Cap_Utilization,
-case when ATOM_Deposit_TVL=0 then 0 else ATOM_Borrowed_TVL/ATOM_Deposit_TVL end as ATOM_Cap_Utilization,
-case when USDC_Deposit_TVL=0 then 0 else USDC_Borrowed_TVL/USDC_Deposit_TVL end as USDC_Cap_Utilization,
-case when stATOM_Deposit_TVL=0 then 0 else stATOM_Borrowed_TVL/stATOM_Deposit_TVL end as stATOM_Cap_Utilization,
-Borrow_TVL/Deposit_TVL as Capital_Utilization,
-case when (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) > 10 then 10
-else (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) end as system_health_factor
-from summarized_flows a
-left join (
-select 
-recorded_hour as dt,
-price as OSMO_Price
-from osmosis.core.ez_prices
-where symbol = 'OSMO'
-) b
-on a.dt = b.dt
-left join (
-select 
-recorded_hour as dt,
-price as ATOM_Price
-from osmosis.core.ez_prices
-where symbol = 'ATOM'
-) c
-on a.dt = c.dt
-left join (
-select 
-recorded_hour as dt,
-price as USDC_Price
-from osmosis.core.ez_prices
-where symbol = 'USDC'
-) d
-on a.dt = d.dt
-left join (
-select 
-recorded_hour as dt,
-price as stATOM_Price
-from osmosis.core.ez_prices
-where symbol = 'STATOM'
-) e
-on a.dt = e.dt
-order by dt asc
+    code13 = render("mars_tvl")
+    st.code(code13, language="sql", line_numbers=False)
 
- 
-    ''' 
-    st.code(code13, language="sql", line_numbers=False)            
-    
-    sql10 = """
-       with txs as (
-select
-distinct a.tx_id,
-a.msg_group,
-action
-from (
-select
-tx_id,
-msg_group,
-attribute_value as action
-from osmosis.core.fact_msg_attributes
-where attribute_key = 'action' and 
-(attribute_value = 'borrow' or attribute_value = 'deposit' or attribute_value = 'withdraw' or attribute_value = 'repay'
-)) a
-left join osmosis.core.fact_msg_attributes b
-on a.tx_id = b.tx_id
-where b.attribute_key = '_contract_address' and b.attribute_value = 'osmo1c3ljch9dfw5kf52nfwpxd2zmj2ese7agnx0p9tenkrryasrle5sqf3ftpg'
-),
-
-asset_flows as (
-
-select distinct *
-
-from (
-
-select
-date_trunc('hour',a.block_timestamp) as dt,
-a.tx_id,
-b.action,
-d.token as asset,
-a.amount/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount,
-a.amount*e.price/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount_usd
-from (
-select
-block_timestamp,
-tx_id,
-msg_group,
-attribute_value as amount
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm' and attribute_key = 'amount_scaled'
-) a
-join txs b
-on a.tx_id = b.tx_id and a.msg_group = b.msg_group
-join (
-select
-tx_id,
-msg_group,
-attribute_value as denom
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm-interests_updated' and attribute_key = 'denom'
-) c
-on a.tx_id = c.tx_id and a.msg_group = c.msg_group
-join (
-select
-address,
-upper(project_name) as token,
-decimal
-from osmosis.core.dim_tokens
-) d 
-on c.denom = d.address
-join (
-select 
-recorded_hour,
-symbol,
-price
-from osmosis.core.ez_prices
-) e 
-on d.token = e.symbol and date_trunc('hour',a.block_timestamp) = e.recorded_hour
-join (
-select
-tx_id,
-msg_group,
-attribute_value as liquidity_index
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm-interests_updated' and attribute_key = 'liquidity_index'
-) f
-on a.tx_id = f.tx_id and a.msg_group = f.msg_group
-where e.recorded_hour is not null
-)
-),
-
-summarized_flows as (
-
-select 
-  dt,
-  sum(coalesce(case when action = 'deposit' and asset = 'OSMO' then amount end,0)) as Deposited_OSMO,
-  sum(coalesce(case when action = 'deposit' and asset = 'ATOM' then amount end,0)) as Deposited_ATOM,
-  sum(coalesce(case when action = 'deposit' and asset = 'USDC' then amount end,0)) as Deposited_USDC,
-  sum(coalesce(case when action = 'deposit' and asset = 'STATOM' then amount end,0)) as Deposited_stATOM,
-  sum(coalesce(case when action = 'borrow' and asset = 'OSMO' then amount end,0)) as Borrowed_OSMO,
-  sum(coalesce(case when action = 'borrow' and asset = 'ATOM' then amount end,0)) as Borrowed_ATOM,
-  sum(coalesce(case when action = 'borrow' and asset = 'USDC' then amount end,0)) as Borrowed_USDC,
-  sum(coalesce(case when action = 'borrow' and asset = 'STATOM' then amount end,0)) as Borrowed_stATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'OSMO' then amount end,0)) as Withdrawn_OSMO,
-  sum(coalesce(case when action = 'withdraw' and asset = 'ATOM' then amount end,0)) as Withdrawn_ATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'STATOM' then amount end,0)) as Withdrawn_stATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'USDC' then amount end,0)) as Withdrawn_USDC,
-  sum(coalesce(case when action = 'repay' and asset = 'OSMO' then amount end,0)) as Repaid_OSMO,
-  sum(coalesce(case when action = 'repay' and asset = 'ATOM' then amount end,0)) as Repaid_ATOM,
-  sum(coalesce(case when action = 'repay' and asset = 'USDC' then amount end,0)) as Repaid_USDC,
-  sum(coalesce(case when action = 'repay' and asset = 'STATOM' then amount end,0)) as Repaid_stATOM,
-  SUM(Deposited_OSMO) over (order by dt asc) as Cum_Deposit_OSMO,
-  SUM(Borrowed_OSMO) over (order by dt asc) as Cum_Borrowed_OSMO,
-  SUM(Withdrawn_OSMO) over (order by dt asc) as Cum_Withdrawn_OSMO,
-  SUM(Repaid_OSMO) over (order by dt asc) as Cum_Repaid_OSMO,
-  SUM(Deposited_ATOM) over (order by dt asc) as Cum_Deposit_ATOM,
-  SUM(Borrowed_ATOM) over (order by dt asc) as Cum_Borrowed_ATOM,
-  SUM(Withdrawn_ATOM) over (order by dt asc) as Cum_Withdrawn_ATOM,
-  SUM(Repaid_ATOM) over (order by dt asc) as Cum_Repaid_ATOM,
-  SUM(Deposited_USDC) over (order by dt asc) as Cum_Deposit_USDC,
-  SUM(Borrowed_USDC) over (order by dt asc) as Cum_Borrowed_USDC,
-  SUM(Withdrawn_USDC) over (order by dt asc) as Cum_Withdrawn_USDC,
-  SUM(Repaid_USDC) over (order by dt asc) as Cum_Repaid_USDC,
-  SUM(Deposited_stATOM) over (order by dt asc) as Cum_Deposit_stATOM,
-  SUM(Borrowed_stATOM) over (order by dt asc) as Cum_Borrowed_stATOM,
-  SUM(Withdrawn_stATOM) over (order by dt asc) as Cum_Withdrawn_stATOM,
-  SUM(Repaid_stATOM) over (order by dt asc) as Cum_Repaid_stATOM
-from asset_flows
-group by 1
-order by 1 asc
-
-)
-
-select 
-a.*,
-coalesce((cum_deposit_OSMO-cum_withdrawn_OSMO)*OSMO_price,0) as OSMO_Deposit_TVL,
-coalesce((cum_deposit_ATOM-cum_withdrawn_ATOM)*ATOM_price,0) as ATOM_Deposit_TVL,
-coalesce((cum_deposit_stATOM-cum_withdrawn_stATOM)*stATOM_price,0) as stATOM_Deposit_TVL,
-coalesce((cum_deposit_USDC-cum_withdrawn_USDC)*USDC_price,0) as USDC_Deposit_TVL,
-coalesce((cum_borrowed_OSMO-cum_repaid_OSMO)*OSMO_price,0) as OSMO_Borrowed_TVL,
-coalesce((cum_borrowed_ATOM-cum_repaid_ATOM)*ATOM_price,0) as ATOM_Borrowed_TVL,
-coalesce((cum_borrowed_USDC-cum_repaid_USDC)*USDC_price,0) as USDC_Borrowed_TVL,
-coalesce((cum_borrowed_stATOM-cum_repaid_stATOM)*stATOM_price,0) as stATOM_Borrowed_TVL,
-OSMO_Deposit_TVL+ATOM_Deposit_TVL+USDC_Deposit_TVL+stATOM_Deposit_TVL as Deposit_TVL,
-OSMO_Borrowed_TVL+ATOM_Borrowed_TVL+USDC_Borrowed_TVL+stATOM_Borrowed_TVL as Borrow_TVL,
-Deposit_TVL - Borrow_TVL as Total_TVL,
-OSMO_Deposit_TVL-OSMO_Borrowed_TVL as OSMO_TVL,
-ATOM_Deposit_TVL-ATOM_Borrowed_TVL as ATOM_TVL,
-USDC_Deposit_TVL-USDC_Borrowed_TVL as USDC_TVL,
-stATOM_Deposit_TVL-stATOM_Borrowed_TVL as stATOM_TVL,
-case when OSMO_Deposit_TVL=0 then 0 else OSMO_Borrowed_TVL/OSMO_Deposit_TVL end as OSMO_Cap_Utilization,
-case when ATOM_Deposit_TVL=0 then 0 else ATOM_Borrowed_TVL/ATOM_Deposit_TVL end as ATOM_Cap_Utilization,
-case when USDC_Deposit_TVL=0 then 0 else USDC_Borrowed_TVL/USDC_Deposit_TVL end as USDC_Cap_Utilization,
-case when stATOM_Deposit_TVL=0 then 0 else stATOM_Borrowed_TVL/stATOM_Deposit_TVL end as stATOM_Cap_Utilization,
-Borrow_TVL/Deposit_TVL as Capital_Utilization,
-case when (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) > 10 then 10
-else (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) end as system_health_factor
-from summarized_flows a
-left join (
-select 
-recorded_hour as dt,
-price as OSMO_Price
-from osmosis.core.ez_prices
-where symbol = 'OSMO'
-) b
-on a.dt = b.dt
-left join (
-select 
-recorded_hour as dt,
-price as ATOM_Price
-from osmosis.core.ez_prices
-where symbol = 'ATOM'
-) c
-on a.dt = c.dt
-left join (
-select 
-recorded_hour as dt,
-price as USDC_Price
-from osmosis.core.ez_prices
-where symbol = 'USDC'
-) d
-on a.dt = d.dt
-left join (
-select 
-recorded_hour as dt,
-price as stATOM_Price
-from osmosis.core.ez_prices
-where symbol = 'STATOM'
-) e
-on a.dt = e.dt
-order by dt asc
-
-   
-    """
-    
-    st.experimental_memo(ttl=1000000)
-    @st.experimental_memo
-    def compute(a):
-        results=sdk.query(a)
-        return results
-    
-    results10 = compute(sql10)
-    df10 = pd.DataFrame(results10.records)
-    df10 = df10.sort_values(by ='dt', ascending = True)
     st.write('Using the query above, one can plot the charts below:')
-    
-    fig1 = px.area(df10, x="dt", y="deposit_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily Mars deposit TVL (USD)',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14,
-    bargap=0.15, # gap between bars of adjacent location coordinates.
-    bargroupgap=0.1 # gap between bars of the same location coordinate.
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
 
-    fig1 = px.area(df10, x="dt", y="borrow_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily Mars borrow TVL (USD)',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
+    @st.fragment(run_every=DASHBOARD_REFRESH)
+    def mars_charts():
+        version, df10 = get_refresher().get("mars_tvl")
+
+        def mars_deposit_chart():
+            import plotly.express as px
+
+            fig1 = px.area(df10, x="dt", y="deposit_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2)
+            fig1.update_layout(
+            title='Daily Mars deposit TVL (USD)',
+            xaxis_tickfont_size=14,
+            yaxis_tickfont_size=14,
+            bargap=0.15, # gap between bars of adjacent location coordinates.
+            bargroupgap=0.1 # gap between bars of the same location coordinate.
+            )
+            return fig1
+
+        fig = dashboard_figure(
+            "mars_deposit_tvl", "mars_tvl", version, mars_deposit_chart
+        )
+        plot("mars_deposit_tvl", fig)
+
+        def mars_borrow_chart():
+            import plotly.express as px
+
+            fig1 = px.area(df10, x="dt", y="borrow_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2)
+            fig1.update_layout(
+            title='Daily Mars borrow TVL (USD)',
+            xaxis_tickfont_size=14,
+            yaxis_tickfont_size=14
+            )
+            return fig1
+
+        fig = dashboard_figure(
+            "mars_borrow_tvl", "mars_tvl", version, mars_borrow_chart
+        )
+        plot("mars_borrow_tvl", fig)
+
+    mars_charts()
  
 with tab5:
      
@@ -1020,4 +642,9 @@ with tab5:
     st.write('- [Flipside docs](https://docs.flipsidecrypto.com/), with a detailed introduction and information on how Flipside works')
     st.write('- [Database info](https://flipsidecrypto.github.io/osmosis-models/#!/overview/osmosis_models), with even more detail on each table for Osmosis.')
     st.write('- [Twitter account](https://twitter.com/flipsidecrypto), to keep up to date with the latest news')
-    
+
+
+# Debug panel, rendered last so it includes this run's timings
+if st.sidebar.checkbox("Show stage timings"):
+    st.sidebar.dataframe(pd.DataFrame(snapshot()))
+    st.sidebar.write("Editor results", get_result_store().usage())
@@ -0,0 +1,53 @@
+from importtime import DEFERRED, STARTUP, profile
+from query_osmosis.mars import mars_tvl
+from query_osmosis.refresher import Refresher
+from query_osmosis.schema import schema_tables
+from query_osmosis.staking import StakingLedger
+
+# Modules of the old import block app.py no longer needs at startup
+HEAVY = ["seaborn", "matplotlib", "transpose", "requests"]
+
+
+def bench_schema_sidebar(benchmark, schema_df):
+    tables = benchmark(schema_tables, schema_df, "core")
+    assert tables
+
+
+def bench_mars_tvl(benchmark, mars_flows):
+    df = benchmark(mars_tvl, mars_flows)
+    assert len(df) == mars_flows["dt"].nunique()
+
+
+# app.py's imports leave out the heavy modules of the import block it used to
+# have. Import times are reported by the benchmark but not asserted, as they
+# are too noisy, and how many modules the old block loads depends on which of
+# them are installed.
+def bench_cold_start(benchmark):
+    loaded = []
+
+    def startup():
+        _, _, _, missing, modules = profile(STARTUP)
+        loaded.extend(modules)
+        return missing
+
+    assert not any(benchmark.pedantic(startup, rounds=3))
+    assert not set(loaded) & set(DEFERRED + HEAVY)
+
+
+def bench_staking_top(benchmark, staking_ledger):
+    df = benchmark(staking_ledger.top, 20)
+    assert list(df["rank"]) == sorted(df["rank"])
+
+
+def bench_staking_increment(benchmark, staking_events):
+    ledger = StakingLedger()
+    ledger.apply(staking_events)
+    increment = staking_events.tail(1000)
+    benchmark(ledger.apply, increment)
+
+
+def bench_refresh_unchanged(benchmark, mars_flows):
+    refresher = Refresher()
+    refresher.add("mars_tvl", lambda: mars_tvl(mars_flows))
+    version, _ = refresher.get("mars_tvl")
+    assert benchmark(refresher.refresh, "mars_tvl")[0] == version
@@ -0,0 +1,12 @@
+import pandas as pd
+
+from query_osmosis.fake import synthetic_records
+from query_osmosis.shared_cache import open_shared_cache
+
+
+def bench_shared_cache_hit(benchmark, tmp_path):
+    cache = open_shared_cache(f"sqlite:///{tmp_path / 'cache.db'}")
+    expected = pd.DataFrame(synthetic_records(100000))
+    cache.frame("select 1", lambda: expected)
+    df = benchmark(cache.frame, "select 1", lambda: None)
+    assert df.equals(expected)
@@ -0,0 +1,59 @@
+import pytest
+
+from query_osmosis.cassette import cassette_sdk
+from query_osmosis.fake import FakeShroomDK, synthetic_records
+from query_osmosis.flipside import FlipsideProvider, query_flipside
+from query_osmosis.materialize import MaterializingProvider
+from query_osmosis.providers import run_query
+from query_osmosis.queries import render, semantic_sql
+
+SQL = "select * from osmosis.core.fact_transfers"
+
+
+@pytest.mark.parametrize("rows,page_size", [(1000, 100000), (50000, 10000)])
+def bench_query_flipside(benchmark, rows, page_size):
+    sdk = FakeShroomDK(default=lambda sql: synthetic_records(rows, seed=sql))
+    df = benchmark(query_flipside, SQL, sdk, page_size=page_size)
+    assert len(df) == rows
+
+
+def bench_query_flipside_latency(benchmark):
+    sdk = FakeShroomDK(latency=0.05, page_latency=0.01)
+    df = benchmark.pedantic(query_flipside, (SQL, sdk), rounds=5)
+    assert len(df) == 1000
+
+
+def bench_run_query(benchmark, fake_sdk):
+    providers = {"Flipside": FlipsideProvider(fake_sdk)}
+    df = benchmark(run_query, SQL, "Flipside", providers)
+    assert "__row_index" not in df.columns
+
+
+def bench_replay(benchmark, tmp_path):
+    path = str(tmp_path / "transfers.cassette")
+    sdk = FakeShroomDK(default=lambda sql: synthetic_records(50000, seed=sql))
+    recorded = query_flipside(SQL, cassette_sdk(f"record:{path}", lambda: sdk))
+    df = benchmark(query_flipside, SQL, cassette_sdk(f"replay:{path}", None))
+    assert df.equals(recorded)
+
+
+# Uncached, on the largest tutorial query the editor is likely to see
+def bench_semantic_sql(benchmark):
+    sql = render("staking_share")
+    key = benchmark(semantic_sql.__wrapped__, sql)
+    assert key == semantic_sql("-- pasted\n" + sql.replace("\n", "\n  "))
+
+
+# A query over a CTE whose result is already stored locally
+def bench_materialized_cte(benchmark, tmp_path):
+    sql = (
+        "with transfers as (select * from osmosis.core.fact_transfers)"
+        " select currency, count(*) as n, sum(amount) as amount"
+        " from transfers group by 1"
+    )
+    sdk = FakeShroomDK(default=lambda sql: synthetic_records(100000, seed=sql))
+    provider = MaterializingProvider(str(tmp_path), FlipsideProvider(sdk=sdk))
+    provider.query(sql)
+    calls = sdk.calls
+    df = benchmark(provider.query, sql)
+    assert df["n"].sum() == 100000 and sdk.calls == calls
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from query_osmosis.fake import (  # noqa: E402
+    FakeShroomDK,
+    mars_flow_records,
+    staking_event_records,
+)
+from query_osmosis.staking import StakingLedger  # noqa: E402
+
+
+@pytest.fixture
+def fake_sdk():
+    return FakeShroomDK()
+
+
+@pytest.fixture(scope="session")
+def schema_df():
+    return pd.read_csv(os.path.join(ROOT, "assets", "provider_schema_data.csv"))
+
+
+@pytest.fixture(scope="session")
+def mars_flows():
+    return pd.DataFrame(mars_flow_records())
+
+
+@pytest.fixture(scope="session")
+def staking_events():
+    return pd.DataFrame(staking_event_records(500000, delegators=100000))
+
+
+@pytest.fixture(scope="session")
+def staking_ledger(staking_events):
+    ledger = StakingLedger()
+    ledger.apply(staking_events)
+    return ledger
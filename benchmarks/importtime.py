@@ -0,0 +1,115 @@
+# Import-time profile of what app.py loads when a worker starts.
+#
+#     python benchmarks/importtime.py [--top 20]
+#
+# Each module set is imported in a fresh interpreter under `-X importtime`; the
+# report lists the slowest top-level imports, the total import time and the peak
+# RSS of that interpreter. "previous" is the import block app.py used to have,
+# for comparison. Modules that are not installed are skipped and listed.
+import argparse
+import ast
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules app.py imports at module level; imports inside functions and tab
+# blocks are deferred until first use
+def startup_modules(path=os.path.join(ROOT, "app.py")):
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+STARTUP = startup_modules()
+
+DEFERRED = ["plotly.express", "shroomdk"]
+
+PREVIOUS = [
+    "streamlit",
+    "streamlit_ace",
+    "time",
+    "os",
+    "pandas",
+    "shroomdk",
+    "transpose",
+    "requests",
+    "json",
+    "math",
+    "seaborn",
+    "matplotlib.pyplot",
+    "matplotlib.dates",
+    "matplotlib.ticker",
+    "numpy",
+    "plotly.express",
+]
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+_SCRIPT = """
+import importlib, resource, sys
+missing = []
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        missing.append(name)
+print(",".join(sorted(sys.modules)))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+print(",".join(missing))
+"""
+
+
+# Returns (total seconds, peak RSS in MB, [(cumulative s, module)], missing,
+# names of the modules loaded)
+def profile(modules):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SCRIPT, *modules],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    top_level = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match and not match.group(3):
+            top_level.append((int(match.group(2)) / 1e6, match.group(4)))
+    loaded, rss, missing = proc.stdout.splitlines()[-3:]
+    total = sum(seconds for seconds, _ in top_level)
+    peak_mb = int(rss) / 1024  # ru_maxrss is in KiB on Linux
+    imports = sorted(top_level, reverse=True)
+    return total, peak_mb, imports, missing.split(","), loaded.split(",")
+
+
+def report(name, modules, top):
+    total, peak_mb, imports, missing, loaded = profile(modules)
+    lines = [
+        f"== {name}: {total:.3f}s imports, {len(loaded)} modules,"
+        f" {peak_mb:.0f} MB peak RSS"
+    ]
+    lines += [f"  {seconds:8.3f}s  {module}" for seconds, module in imports[:top]]
+    if any(missing):
+        lines.append(f"  not installed: {', '.join(missing)}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+    print(report("startup", STARTUP, args.top))
+    print(report("startup + deferred", STARTUP + DEFERRED, args.top))
+    print(report("previous startup", PREVIOUS, args.top))
+
+
+if __name__ == "__main__":
+    main()
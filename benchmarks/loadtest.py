@@ -0,0 +1,266 @@
+# Concurrent session load test for app.py.
+#
+#     python benchmarks/loadtest.py [--sessions 1,5,10,20] [--reruns 5]
+#                                   [--latency 0.5] [--ramp 0]
+#
+# Starts `streamlit run app.py` headless with FLIPSIDE_FAKE, so every Flipside
+# query is served by query_osmosis.fake.FakeShroomDK, and drives it over the
+# Streamlit websocket the way a browser does. Each simulated session loads the
+# page and then reruns it `--reruns` times, each time after a random
+# interaction: an editor query, a checkbox toggle or a plain rerun. Like the
+# browser, an interaction with a widget inside an st.fragment reruns only that
+# fragment, while a plain rerun runs the whole script. Tabs are
+# switched in the browser without a rerun, so tab switches cost the server
+# nothing and are not simulated. For each number of sessions the report lists
+# rerun latency percentiles per interaction, the server's RSS and the number of
+# pages fetched from the fake backend.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from types import SimpleNamespace
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ACTIONS = ["editor", "checkbox", "rerun"]
+
+# Variants of the same three queries, as users paste them with small edits
+EDITOR_QUERIES = [
+    "select * from osmosis.core.fact_transfers limit 10",
+    "SELECT * FROM Osmosis.Core.Fact_Transfers LIMIT 10;",
+    "select * from osmosis.core.fact_staking where action = 'delegate' limit 100",
+    "-- delegations\nselect * from osmosis.core.fact_staking\n"
+    "where 'delegate' = action limit 100",
+    "select sender, count(*) from osmosis.core.fact_transfers group by 1 limit 1000",
+    "select SENDER, count(*)\nfrom osmosis.core.fact_transfers group by 1 limit 1000",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Current and peak resident set size of `pid` in MB (Linux)
+def rss_mb(pid):
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value
+    return tuple(int(status[key].split()[0]) / 1024 for key in ("VmRSS", "VmHWM"))
+
+
+# Pages served by the fake backend so far; the metrics server only starts once
+# app.py has run
+def upstream_pages(metrics_port):
+    url = f"http://127.0.0.1:{metrics_port}/metrics"
+    try:
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode()
+    except OSError:
+        return 0
+    return sum(
+        float(line.split()[-1])
+        for line in text.splitlines()
+        if line.startswith("query_osmosis_fake_pages_total")
+    )
+
+
+@contextlib.contextmanager
+def start_app(latency):
+    port, metrics_port = free_port(), free_port()
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = {
+            **os.environ,
+            "FLIPSIDE_FAKE": str(latency),
+            "METRICS_PORT": str(metrics_port),
+            "LOCAL_DATA_DIR": data_dir,
+        }
+        proc = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "streamlit",
+                "run",
+                "app.py",
+                "--server.headless=true",
+                f"--server.port={port}",
+                "--server.fileWatcherType=none",
+                "--browser.gatherUsageStats=false",
+            ],
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            url = f"http://127.0.0.1:{port}"
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    urllib.request.urlopen(url + "/_stcore/health")
+                    break
+                except OSError:
+                    if proc.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("streamlit did not start")
+                    time.sleep(0.2)
+            yield SimpleNamespace(url=url, pid=proc.pid, metrics_port=metrics_port)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+# One browser tab: remembers the widgets it has been sent and the state it
+# sends back with every rerun.
+class Session:
+    def __init__(self, url, rng):
+        self.url = url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.rng = rng
+        self.editor = None
+        self.checkboxes = {}  # id -> default
+        self.fragments = {}  # widget id -> id of the fragment it is in
+        self.states = {}  # id -> WidgetState
+        self.fragment = ""  # fragment the next rerun is for, "" for the script
+        self.errors = 0
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, max_message_size=1 << 30)
+
+    def _see(self, element, fragment):
+        kind = element.WhichOneof("type")
+        if kind == "component_instance" and self.editor is None:
+            self.editor = element.component_instance.id  # the editor at the top
+            self.fragments[self.editor] = fragment
+        elif kind == "checkbox":
+            self.checkboxes[element.checkbox.id] = element.checkbox.default
+            self.fragments[element.checkbox.id] = fragment
+        elif kind == "exception":
+            self.errors += 1
+
+    def interact(self, action):
+        widget = None
+        if action == "editor" and self.editor:
+            widget = self.editor
+            state = WidgetState(id=widget)
+            state.json_value = json.dumps(self.rng.choice(EDITOR_QUERIES))
+            self.states[widget] = state
+        elif action == "checkbox" and self.checkboxes:
+            widget = self.rng.choice(sorted(self.checkboxes))
+            current = self.states.get(widget)
+            value = current.bool_value if current else self.checkboxes[widget]
+            self.states[widget] = WidgetState(id=widget, bool_value=not value)
+        self.fragment = self.fragments.get(widget, "")
+
+    # Seconds until the script run this triggers has finished
+    async def rerun(self):
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.fragment_id = self.fragment
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        start = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        while True:
+            payload = await self.ws.read_message()
+            if payload is None:
+                raise ConnectionError("server closed the session")
+            forward = ForwardMsg()
+            forward.ParseFromString(payload)
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                self._see(forward.delta.new_element, forward.delta.fragment_id)
+            elif kind == "script_finished":
+                if forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return time.perf_counter() - start
+
+
+async def run_session(url, reruns, delay, seed, timings):
+    await asyncio.sleep(delay)
+    session = Session(url, random.Random(seed))
+    await session.connect()
+    try:
+        timings.append(("load", await session.rerun()))
+        for _ in range(reruns):
+            action = session.rng.choice(ACTIONS)
+            session.interact(action)
+            timings.append((action, await session.rerun()))
+    finally:
+        session.ws.close()
+    return session.errors
+
+
+# Returns ([(action, seconds)], script errors seen)
+async def load(url, sessions, reruns, ramp, seed):
+    timings = []
+    errors = await asyncio.gather(
+        *(
+            run_session(url, reruns, ramp * i / sessions, seed + i, timings)
+            for i in range(sessions)
+        )
+    )
+    return timings, sum(errors)
+
+
+def report(sessions, timings, errors, rss, pages):
+    lines = [f"== {sessions} sessions"]
+    lines.append(
+        f"  {'action':<10}{'runs':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}"
+    )
+    for action in ["load", *ACTIONS, "all"]:
+        seconds = [s for a, s in timings if action in (a, "all")]
+        if not seconds:
+            continue
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+        lines.append(
+            f"  {action:<10}{len(seconds):>6}"
+            f"{p50:>8.3f}s{p90:>8.3f}s{p99:>8.3f}s{max(seconds):>8.3f}s"
+        )
+    (before, _), (after, peak) = rss
+    lines.append(
+        f"  server RSS {before:.0f} -> {after:.0f} MB"
+        f" (peak {peak:.0f} MB, {(after - before) / sessions:+.1f} MB per session)"
+    )
+    lines.append(
+        f"  upstream pages {pages:.0f} ({pages / len(timings):.2f} per run),"
+        f" script errors {errors}"
+    )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", default="1,5,10,20")
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    with start_app(args.latency) as app:
+        for sessions in [int(n) for n in args.sessions.split(",")]:
+            rss_before = rss_mb(app.pid)
+            pages_before = upstream_pages(app.metrics_port)
+            timings, errors = asyncio.run(
+                load(app.url, sessions, args.reruns, args.ramp, args.seed)
+            )
+            pages = upstream_pages(app.metrics_port) - pages_before
+            rss = (rss_before, rss_mb(app.pid))
+            print(report(sessions, timings, errors, rss, pages), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Query building, caching and post-processing helpers used by app.py
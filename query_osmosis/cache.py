@@ -0,0 +1,54 @@
+# Result-cache front end for registered queries
+import datetime
+import threading
+
+import pandas as pd
+
+from query_osmosis.metrics import timed
+from query_osmosis.queries import QUERIES, plan
+
+
+# Remembers the widest window fetched today for each windowed query, so a
+# narrower window is served by trimming the wider cached result instead of
+# going back to Flipside.
+class WindowIndex:
+    def __init__(self):
+        self._widest = {}
+        self._lock = threading.Lock()
+
+    def widen(self, query, bound):
+        if query.window is None:
+            return bound
+        partition = dict(bound)
+        partition[query.window] = None
+        key = (query.name, datetime.date.today(), tuple(sorted(partition.items())))
+        with self._lock:
+            days = max(self._widest.get(key, 0), bound[query.window])
+            self._widest[key] = days
+        return {**bound, query.window: days}
+
+
+window_index = WindowIndex()
+
+
+# Keep only the rows of a wider-window result that fall in the requested window
+def trim_window(query, df, days):
+    if query.partition_column not in df.columns:
+        return df
+    start = pd.Timestamp(datetime.date.today() - datetime.timedelta(days=days))
+    dates = pd.to_datetime(df[query.partition_column]).dt.tz_localize(None)
+    return df[dates >= start].reset_index(drop=True)
+
+
+# Run a registered query through `fetch(key, sql)`, which returns a DataFrame and
+# is expected to cache on `key` (the canonical SQL).
+def fetch_query(name, fetch, **values):
+    query = QUERIES[name]
+    bound = query.bind(**values)
+    widened = window_index.widen(query, bound)
+    sql, key = plan(name, **widened)
+    with timed("fetch_query", query=name):
+        df = fetch(key, sql)
+        if widened != bound:
+            df = trim_window(query, df, bound[query.window])
+    return df
@@ -0,0 +1,132 @@
+# Record Flipside responses to a cassette file and replay them without network
+#
+# A cassette is an append-only log of compressed result pages:
+#
+#     MAGIC, then per page: key length (u32), key, blob length (u32), blob
+#
+# The key is "<sha1 of canonical SQL>:<page size>:<page number>" and the blob is
+# the page's records as zlib-compressed JSON. Replay memory-maps the file, scans
+# the headers once to index every page, and decompresses pages on demand.
+import functools
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from query_osmosis.fake import query_result
+from query_osmosis.queries import canonical_sql
+
+MAGIC = b"QOCASSETTE1\n"
+_LENGTH = struct.Struct("<I")
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+def page_key(sql, page_size, page_number):
+    digest = hashlib.sha1(canonical_sql(sql).encode()).hexdigest()
+    return f"{digest}:{page_size}:{page_number}"
+
+
+class CassetteWriter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+
+    def write(self, key, records):
+        key = key.encode()
+        blob = zlib.compress(
+            json.dumps(records, separators=(",", ":"), default=str).encode()
+        )
+        with self._lock, open(self.path, "ab") as f:
+            f.write(_LENGTH.pack(len(key)) + key + _LENGTH.pack(len(blob)) + blob)
+
+
+class Cassette:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a query cassette")
+        self.index = {}
+        pos = len(MAGIC)
+        end = len(self._map)
+        while pos + _LENGTH.size <= end:
+            (key_length,) = _LENGTH.unpack_from(self._map, pos)
+            pos += _LENGTH.size
+            if pos + key_length + _LENGTH.size > end:
+                break  # truncated by an interrupted recording
+            key = self._map[pos : pos + key_length].decode()
+            pos += key_length
+            (blob_length,) = _LENGTH.unpack_from(self._map, pos)
+            pos += _LENGTH.size
+            if pos + blob_length > end:
+                break
+            self.index[key] = (pos, blob_length)
+            pos += blob_length
+        self._page = functools.lru_cache(maxsize=256)(self._decode)
+
+    def _decode(self, offset, length):
+        return json.loads(zlib.decompress(self._map[offset : offset + length]))
+
+    def records(self, key):
+        try:
+            return self._page(*self.index[key])
+        except KeyError:
+            raise CassetteMiss(key) from None
+
+
+# Passes queries through to a real client and appends every page to a cassette
+class RecordingShroomDK:
+    def __init__(self, sdk, path):
+        self.sdk = sdk
+        self.writer = _writer(path)
+
+    def query(self, sql, page_size=100000, page_number=1, **kwargs):
+        result = self.sdk.query(
+            sql, page_size=page_size, page_number=page_number, **kwargs
+        )
+        self.writer.write(page_key(sql, page_size, page_number), result.records or [])
+        return result
+
+
+# Serves pages from a cassette; a query that was never recorded raises CassetteMiss
+class ReplayShroomDK:
+    def __init__(self, path):
+        self.cassette = open_cassette(path)
+
+    def query(self, sql, page_size=100000, page_number=1, **kwargs):
+        records = self.cassette.records(page_key(sql, page_size, page_number))
+        return query_result(records, page_number, page_size)
+
+
+@functools.lru_cache(maxsize=None)
+def _writer(path):
+    return CassetteWriter(path)
+
+
+@functools.lru_cache(maxsize=None)
+def open_cassette(path):
+    return Cassette(path)
+
+
+# Build the client for a FLIPSIDE_CASSETTE setting of "record:<path>" or
+# "replay:<path>". `connect` returns the real client and is not called when
+# replaying, so no API key is needed.
+def cassette_sdk(spec, connect):
+    if not spec:
+        return connect()
+    mode, _, path = spec.partition(":")
+    if mode == "replay":
+        return ReplayShroomDK(path)
+    if mode == "record":
+        return RecordingShroomDK(connect(), path)
+    raise ValueError("FLIPSIDE_CASSETTE must be record:<path> or replay:<path>")
@@ -0,0 +1,223 @@
+# Offline stand-in for the ShroomDK client, for benchmarks and load tests
+import hashlib
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from query_osmosis.metrics import count
+from query_osmosis.queries import MARS_ASSETS, MARS_ACTIONS, canonical_sql, render
+
+
+class FakeQueryError(Exception):
+    pass
+
+
+def query_result(records, page_number=1, page_size=None, total=None):
+    columns = list(records[0]) if records else []
+    total = len(records) if total is None else total
+    return SimpleNamespace(
+        query_id=None,
+        status="FINISHED",
+        columns=columns,
+        column_types=None,
+        rows=None,
+        records=records,
+        run_stats=SimpleNamespace(record_count=len(records)),
+        page=SimpleNamespace(
+            currentPageNumber=page_number,
+            currentPageSize=page_size,
+            totalRows=total,
+            totalPages=-(-total // page_size) if page_size else 1,
+        ),
+        error=None,
+    )
+
+
+# Serves paged results the way `ShroomDK.query` does.
+#
+# `responses` maps SQL (matched on its canonical form) to a list of records or
+# to a function returning one; anything else goes to `default`, which gets the
+# SQL. `latency` is paid once per query, on page 1, and `page_latency` on every
+# page. `failures` is a set of page numbers that raise, or a probability.
+class FakeShroomDK:
+    def __init__(
+        self,
+        responses=None,
+        default=None,
+        latency=0.0,
+        page_latency=0.0,
+        failures=(),
+        seed=0,
+    ):
+        self.responses = {
+            canonical_sql(sql): records for sql, records in (responses or {}).items()
+        }
+        self.default = default or (lambda sql: synthetic_records(1000, seed=sql))
+        self.latency = latency
+        self.page_latency = page_latency
+        self.failures = failures
+        self.calls = 0
+        self.pages = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def _records(self, sql):
+        key = canonical_sql(sql)
+        with self._lock:
+            if key not in self._results:
+                records = self.responses.get(key, self.default)
+                if callable(records):
+                    records = records(sql)
+                self._results[key] = [
+                    {**record, "__row_index": i} for i, record in enumerate(records)
+                ]
+            return self._results[key]
+
+    def _fail(self, page_number):
+        if isinstance(self.failures, float):
+            return self._random.random() < self.failures
+        return page_number in self.failures
+
+    def query(self, sql, page_size=100000, page_number=1, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.pages += 1
+        # Visible on /metrics, so load tests can count upstream work
+        count("query_osmosis_fake_pages_total", help="Pages served by FakeShroomDK")
+        if page_number == 1 and self.latency:
+            time.sleep(self.latency)
+        if self.page_latency:
+            time.sleep(self.page_latency)
+        if self._fail(page_number):
+            raise FakeQueryError(f"injected failure on page {page_number}")
+        records = self._records(sql)
+        start = (page_number - 1) * page_size
+        return query_result(
+            records[start : start + page_size], page_number, page_size, len(records)
+        )
+
+
+# Records shaped like a Flipside result. `seed` may be any string, so the same
+# SQL always gets the same rows.
+def synthetic_records(rows, columns=None, seed=0):
+    if isinstance(seed, str):
+        seed = int(hashlib.sha1(seed.encode()).hexdigest()[:8], 16)
+    rng = np.random.default_rng(seed)
+    columns = columns or ("block_timestamp", "tx_id", "sender", "amount", "currency")
+    start = np.datetime64("2023-01-01T00:00:00")
+    generators = {
+        "block_timestamp": lambda: (
+            start + rng.integers(0, 90 * 86400, rows).astype("timedelta64[s]")
+        ).astype(str),
+        "tx_id": lambda: [f"{v:064X}" for v in rng.integers(0, 2**62, rows)],
+        "sender": lambda: [
+            fake_address(v) for v in rng.integers(0, rows // 4 + 1, rows)
+        ],
+        "amount": lambda: rng.random(rows) * 1000,
+        "currency": lambda: rng.choice(["uosmo", "uion", "ibc/27394FB0"], rows),
+    }
+    data = {
+        column: generators.get(column, lambda: rng.integers(0, 1000, rows))()
+        for column in columns
+    }
+    return pd.DataFrame(data).to_dict("records")
+
+
+_BECH32 = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+
+def fake_address(n, prefix="osmo1"):
+    rng = random.Random(int(n))
+    return prefix + "".join(rng.choice(_BECH32) for _ in range(38))
+
+
+# Long-format rows as returned by the `mars_flows` query
+def mars_flow_records(hours=24 * 90, assets=MARS_ASSETS, density=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    actions = [action for action, _, _ in MARS_ACTIONS]
+    records = []
+    start = pd.Timestamp("2023-01-01")
+    for h in range(hours):
+        dt = str(start + pd.Timedelta(hours=h))
+        for asset in assets:
+            price = float(rng.random() * 10)
+            moved = [a for a in actions if rng.random() < density]
+            for action in moved or [None]:
+                amount = float(rng.random() * 1000) if action else 0.0
+                records.append(
+                    {
+                        "dt": dt,
+                        "asset": asset,
+                        "action": action,
+                        "amount": amount,
+                        "price": price,
+                    }
+                )
+    return records
+
+
+# osmosis.core.fact_staking rows for `delegators` accounts spread over
+# `validators`, in block order, as read by the `staking_events` query
+def staking_event_records(rows=100000, delegators=10000, validators=150, seed=0):
+    rng = np.random.default_rng(seed)
+    delegator_pool = [fake_address(i) for i in range(delegators)]
+    validator_pool = [fake_address(i, "osmovaloper1") for i in range(validators)]
+    actions = rng.choice(
+        ["delegate", "undelegate", "redelegate"], rows, p=[0.6, 0.25, 0.15]
+    )
+    blocks = np.sort(rng.integers(1, rows // 4 + 2, rows))
+    delegator = rng.integers(0, delegators, rows)
+    validator = rng.integers(0, validators, rows)
+    source = rng.integers(0, validators, rows)
+    amount = rng.gamma(1.5, 500, rows)
+    return [
+        {
+            "block_id": int(blocks[i]),
+            "action": actions[i],
+            "delegator_address": delegator_pool[delegator[i]],
+            "validator_address": validator_pool[validator[i]],
+            "redelegate_source_validator_address": (
+                validator_pool[source[i]] if actions[i] == "redelegate" else None
+            ),
+            "amount": float(amount[i]),
+        }
+        for i in range(rows)
+    ]
+
+
+# Results shaped like the dashboard queries in app.py, so the app runs end to
+# end on FakeShroomDK (FLIPSIDE_FAKE). Other SQL gets synthetic records.
+def app_responses(seed=0):
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp.today().normalize()
+    days = [str(today - pd.Timedelta(days=d)) for d in range(30)]
+    transfer_types = ["IBC_TRANSFER_IN", "IBC_TRANSFER_OUT"]
+    actions = ["delegate", "undelegate", "redelegate"]
+    return {
+        render("ibc_transfers_daily", days=30): [
+            {"date": d, "transfer_type": t, "num_tx": int(rng.integers(1000, 9000))}
+            for d in days
+            for t in transfer_types
+        ],
+        render("staking_daily", days=30, currency="uosmo"): [
+            {"date": d, "action": a, "total_amount": float(rng.random() * 1e6)}
+            for d in days
+            for a in actions
+        ],
+        render("mars_flows"): mars_flow_records(hours=24 * 30, seed=seed),
+        render("staking_events"): staking_event_records(seed=seed),
+    }
+
+
+# `default` for app_responses: no staking events after the first batch
+def app_default(sql):
+    since = re.search(r"block_id > (\d+)", sql)
+    if since and int(since.group(1)) > 0:
+        return []
+    return synthetic_records(1000, seed=sql)
@@ -0,0 +1,81 @@
+# Flipside provider on top of a ShroomDK client
+import os
+from types import SimpleNamespace
+
+import pandas as pd
+
+from query_osmosis.metrics import timed
+from query_osmosis.providers import MAX_PAGES, PAGE_SIZE, Provider
+
+SCHEMA_CSV = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "assets",
+    "provider_schema_data.csv",
+)
+RUNNING_STATES = ("QUERY_STATE_READY", "QUERY_STATE_RUNNING", "PENDING")
+
+
+# `sdk` is a ShroomDK client or anything with the same `query` method (see
+# query_osmosis.fake and query_osmosis.cassette); pass `connect` instead to build
+# it on first use. Pages after the first are read with `get_query_results` when
+# the client has it, so the query is not resubmitted for every page.
+class FlipsideProvider(Provider):
+    name = "Flipside"
+
+    def __init__(self, sdk=None, connect=None, schema_csv=SCHEMA_CSV):
+        self._sdk = sdk
+        self._connect = connect
+        self.schema_csv = schema_csv
+
+    @property
+    def sdk(self):
+        if self._sdk is None:
+            self._sdk = self._connect()
+        return self._sdk
+
+    def submit(self, sql, page_size=PAGE_SIZE):
+        # the first call submits the query and waits for it
+        with timed("flipside.submit"):
+            first = self.sdk.query(sql, page_size=page_size, page_number=1)
+        return SimpleNamespace(sql=sql, page_size=page_size, first=first)
+
+    def fetch_page(self, handle, page_number):
+        if page_number == 1:
+            data = handle.first
+        else:
+            with timed("flipside.page"):
+                query_id = getattr(handle.first, "query_id", None)
+                if query_id and hasattr(self.sdk, "get_query_results"):
+                    data = self.sdk.get_query_results(
+                        query_id, page_number=page_number, page_size=handle.page_size
+                    )
+                else:
+                    data = self.sdk.query(
+                        handle.sql, page_size=handle.page_size, page_number=page_number
+                    )
+        if not data.run_stats.record_count:
+            return pd.DataFrame()
+        with timed("flipside.normalize"):
+            page = pd.json_normalize(data.records)
+        return page.drop(columns=["__row_index"], errors="ignore")
+
+    def total_rows(self, handle):
+        page = getattr(handle.first, "page", None)
+        return getattr(page, "totalRows", None)
+
+    def cancel(self, handle):
+        query_id = getattr(handle.first, "query_id", None)
+        running = getattr(handle.first, "status", None) in RUNNING_STATES
+        if query_id and running and hasattr(self.sdk, "cancel_query_run"):
+            self.sdk.cancel_query_run(query_id)
+
+    def schema(self):
+        schema_df = pd.read_csv(self.schema_csv)
+        return schema_df[schema_df["datawarehouse"] == self.name].drop(
+            columns=["datawarehouse"]
+        )
+
+
+# Query Flipside using their Python SDK
+def query_flipside(q, sdk, page_size=PAGE_SIZE, max_pages=MAX_PAGES):
+    return FlipsideProvider(sdk).query(q, page_size, max_pages)
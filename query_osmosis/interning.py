@@ -0,0 +1,104 @@
+# Dictionary encoding for address and hash columns
+#
+# Osmosis results are dominated by long bech32 addresses and tx hashes, which
+# pandas keeps as one Python string per cell. `intern_frame` replaces such
+# columns with int32 codes into one process-wide dictionary, so each distinct
+# string is stored once however many rows and results refer to it, and lists
+# the encoded columns in `df.attrs["interned"]`. `decode_frame` turns the codes
+# back into strings and is meant to run only when a result is displayed.
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+NULL = -1
+SAMPLE_SIZE = 64
+
+_ADDRESS = re.compile(r"[a-z]{2,20}1[02-9ac-hj-np-z]{38,90}")
+_HASH = re.compile(r"(?:0x)?[0-9A-Fa-f]{64}")
+
+
+class Interner:
+    def __init__(self):
+        self._codes = {}
+        self._strings = []
+        self._lookup = np.empty(0, dtype=object)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._strings)
+
+    # int32 codes for `values`; nulls get NULL
+    def encode(self, values):
+        local_codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        with self._lock:
+            mapping = np.empty(len(uniques), dtype=np.int32)
+            for i, value in enumerate(uniques):
+                code = self._codes.get(value)
+                if code is None:
+                    code = self._codes[value] = len(self._strings)
+                    self._strings.append(value)
+                mapping[i] = code
+        codes = np.full(len(local_codes), NULL, dtype=np.int32)
+        present = local_codes >= 0
+        codes[present] = mapping[local_codes[present]]
+        return codes
+
+    # Code of a string already in the dictionary, NULL otherwise
+    def code(self, value):
+        return self._codes.get(value, NULL)
+
+    # Strings for `codes`, as an object array with None for NULL
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        with self._lock:
+            if len(self._lookup) != len(self._strings) + 1:
+                self._lookup = np.array(self._strings + [None], dtype=object)
+            lookup = self._lookup
+        return lookup[np.where(codes == NULL, len(lookup) - 1, codes)]
+
+
+interner = Interner()
+
+
+# Object columns whose non-null values all look like addresses or tx hashes
+def address_columns(df):
+    columns = []
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        sample = df[column].dropna().head(SAMPLE_SIZE)
+        if sample.empty:
+            continue
+        if all(
+            isinstance(value, str)
+            and (_ADDRESS.fullmatch(value) or _HASH.fullmatch(value))
+            for value in sample
+        ):
+            columns.append(column)
+    return columns
+
+
+# `columns` defaults to the detected address columns; pass the columns found in
+# the first page to encode later pages of the same result the same way.
+def intern_frame(df, columns=None):
+    columns = address_columns(df) if columns is None else columns
+    if not columns:
+        return df
+    df = df.assign(**{column: interner.encode(df[column]) for column in columns})
+    df.attrs["interned"] = list(df.attrs.get("interned", [])) + columns
+    return df
+
+
+def interned_columns(df):
+    return [column for column in df.attrs.get("interned", []) if column in df.columns]
+
+
+def decode_frame(df):
+    columns = interned_columns(df)
+    if not columns:
+        return df
+    df = df.assign(**{column: interner.decode(df[column]) for column in columns})
+    df.attrs = {key: value for key, value in df.attrs.items() if key != "interned"}
+    return df
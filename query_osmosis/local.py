@@ -0,0 +1,231 @@
+# Local DuckDB provider over cached Osmosis tables stored as Parquet
+#
+# Tables live under `root` as <database>/<schema>/<table>.parquet, or as a
+# directory of Parquet files with that name, e.g.
+# data/osmosis/core/fact_transfers.parquet. Copies are made with `ingest`
+# (python -m query_osmosis.local <table> ...) and are only used while younger
+# than `max_age`. duckdb (and sqlglot, used to translate Snowflake SQL) are
+# optional and only imported when a query runs.
+#
+# Editor SQL runs here as written, so each query gets its own connection that
+# can read the Parquet files of the tables it references and nothing else: no
+# other files, no network, no settings changes. A query still running after
+# `timeout` seconds is interrupted.
+import argparse
+import contextlib
+import glob
+import importlib.util
+import os
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import pandas as pd
+
+from query_osmosis.interning import decode_frame
+from query_osmosis.metrics import timed
+from query_osmosis.providers import MAX_PAGES, PAGE_SIZE, Provider, referenced_tables
+
+LOCAL_MAX_AGE = 86400  # seconds a local copy of a table answers queries
+LOCAL_TIMEOUT = 60  # seconds a local query may run
+
+
+def duckdb_available():
+    return importlib.util.find_spec("duckdb") is not None
+
+
+# Snowflake SQL in DuckDB's dialect, unchanged when sqlglot is not installed
+def to_duckdb(sql):
+    if importlib.util.find_spec("sqlglot") is None:
+        return sql
+    import sqlglot
+
+    return sqlglot.transpile(sql, read="snowflake", write="duckdb")[0]
+
+
+class DuckDBProvider(Provider):
+    name = "Local"
+
+    def __init__(self, root, max_age=LOCAL_MAX_AGE, timeout=LOCAL_TIMEOUT):
+        self.root = root
+        self.max_age = max_age
+        self.timeout = timeout
+
+    def tables(self):
+        tables = {}
+        pattern = os.path.join(self.root, "*", "*", "*.parquet")
+        for path in glob.glob(pattern):
+            relative = os.path.relpath(path, self.root)
+            database, schema, table = relative[: -len(".parquet")].split(os.sep)
+            if os.path.isdir(path):
+                path = os.path.join(path, "*.parquet")
+            tables[f"{database}.{schema}.{table}".lower()] = path
+        return tables
+
+    # Covered when every table the query reads has a local copy younger than
+    # `max_age`
+    def covers(self, sql):
+        if not duckdb_available():
+            return False
+        needed = referenced_tables(sql)
+        tables = self.tables()
+        return bool(needed) and all(
+            name in tables and self._fresh(tables[name]) for name in needed
+        )
+
+    def _fresh(self, path):
+        paths = glob.glob(path)
+        return bool(paths) and all(
+            time.time() - os.path.getmtime(p) < self.max_age for p in paths
+        )
+
+    # A connection with a view per referenced table, then locked down so the
+    # query can only read those tables' files
+    def _connect(self, sql):
+        import duckdb
+
+        con = duckdb.connect()
+        tables = self.tables()
+        databases, paths = set(), []
+        for name in referenced_tables(sql):
+            database, schema, table = name.split(".")
+            if database not in databases:
+                con.execute(f"attach ':memory:' as {database}")
+                databases.add(database)
+            con.execute(f"create schema if not exists {database}.{schema}")
+            files = sorted(glob.glob(tables[name]))
+            paths += files
+            listed = ", ".join("'{}'".format(f.replace("'", "''")) for f in files)
+            con.execute(f"create view {name} as select * from read_parquet([{listed}])")
+        con.execute("set allowed_paths = ?", [paths])
+        con.execute("set enable_external_access = false")
+        con.execute("set lock_configuration = true")
+        return con
+
+    def submit(self, sql, page_size=PAGE_SIZE):
+        con = self._connect(sql)
+        handle = SimpleNamespace(
+            con=con, reader=None, page_size=page_size, rest=[], expired=False
+        )
+        handle.timer = threading.Timer(self.timeout, self._expire, [handle])
+        handle.timer.daemon = True
+        handle.timer.start()
+        try:
+            with timed("local.execute"), self._timeout(handle):
+                handle.reader = con.execute(to_duckdb(sql)).fetch_record_batch(
+                    page_size
+                )
+        except BaseException:
+            self.cancel(handle)
+            raise
+        return handle
+
+    def _expire(self, handle):
+        handle.expired = True
+        handle.con.interrupt()
+
+    # Reports an interrupt by the timer as a TimeoutError
+    @contextlib.contextmanager
+    def _timeout(self, handle):
+        import duckdb
+
+        try:
+            yield
+        except duckdb.InterruptException:
+            if not handle.expired:
+                raise
+            raise TimeoutError(f"local query ran over {self.timeout}s") from None
+
+    # Pages are read in order from the open result; batches are regrouped so
+    # every page but the last has exactly `page_size` rows.
+    def fetch_page(self, handle, page_number):
+        import pyarrow as pa
+
+        with timed("local.fetch"), self._timeout(handle):
+            batches = handle.rest
+            rows = sum(len(batch) for batch in batches)
+            while rows < handle.page_size:
+                try:
+                    batch = handle.reader.read_next_batch()
+                except StopIteration:
+                    break
+                batches.append(batch)
+                rows += len(batch)
+            if not batches:
+                return pd.DataFrame()
+            table = pa.Table.from_batches(batches)
+            handle.rest = table.slice(handle.page_size).to_batches()
+            return table.slice(0, handle.page_size).to_pandas()
+
+    def cancel(self, handle):
+        handle.timer.cancel()
+        handle.con.interrupt()
+        handle.con.close()
+
+    def schema(self):
+        import duckdb
+
+        rows = []
+        for name, path in sorted(self.tables().items()):
+            database, schema, table = name.split(".")
+            columns = duckdb.sql(
+                "describe select * from read_parquet(?)", params=[path]
+            ).fetchall()
+            rows += [(database, schema, table, column[0]) for column in columns]
+        return pd.DataFrame(
+            rows, columns=["table_catalog", "table_schema", "table_name", "column_name"]
+        )
+
+    # Save a Flipside result as the local copy of `table` (database.schema.table)
+    # and return its path
+    def store(self, table, df):
+        database, schema, name = table.lower().split(".")
+        directory = os.path.join(self.root, database, schema)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}.parquet")
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"  # workers may store at once
+        decode_frame(df).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        return path
+
+    # Copy a whole table from `upstream` (normally the Flipside provider).
+    # Tables that do not fit in `max_pages` are refused rather than stored in
+    # part, since a partial copy would answer queries as if it were complete.
+    def ingest(self, table, upstream, page_size=PAGE_SIZE, max_pages=MAX_PAGES):
+        with timed("local.ingest", provider=upstream.name):
+            df = upstream.query(
+                f"select * from {table}", page_size, max_pages, intern=False
+            )
+        if len(df) >= page_size * max_pages:
+            raise ValueError(f"{table} has more than {page_size * max_pages} rows")
+        if df.columns.empty:
+            raise ValueError(f"{table} returned no columns")
+        self.store(table, df)
+        return len(df)
+
+
+# python -m query_osmosis.local osmosis.core.dim_tokens [...] copies tables from
+# Flipside (FLIPSIDE_API_KEY) under LOCAL_DATA_DIR; rerun it before the copies
+# are LOCAL_MAX_AGE old
+def main():
+    from query_osmosis.flipside import FlipsideProvider
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tables", nargs="+", help="database.schema.table")
+    parser.add_argument("--root", default=os.environ.get("LOCAL_DATA_DIR", "data"))
+    args = parser.parse_args()
+
+    def connect():
+        from shroomdk import ShroomDK
+
+        return ShroomDK(os.environ["FLIPSIDE_API_KEY"])
+
+    upstream = FlipsideProvider(connect=connect)
+    local = DuckDBProvider(args.root)
+    for table in args.tables:
+        print(f"{table}: {local.ingest(table, upstream)} rows", flush=True)
+
+
+if __name__ == "__main__":
+    main()
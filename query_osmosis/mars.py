@@ -0,0 +1,76 @@
+# Local pivot of the long-format Mars flows into the per-asset TVL table
+import numpy as np
+import pandas as pd
+
+from query_osmosis.queries import COLLATERAL_WEIGHTS, MARS_ACTIONS
+
+HEALTH_FACTOR_CAP = 10
+
+
+# `flows` has one row per (dt, asset) with `price`, plus `action`/`amount` when
+# the asset moved in that hour (see the `mars_flows` query). Returns one row per
+# hour with the same columns the wide `mars_tvl` query produces, for any number
+# of assets.
+def mars_tvl(flows, weights=COLLATERAL_WEIGHTS):
+    flows = flows.assign(
+        dt=pd.to_datetime(flows["dt"]),
+        amount=pd.to_numeric(flows["amount"]),
+        price=pd.to_numeric(flows["price"]),
+    )
+    index = pd.Index(np.sort(flows["dt"].unique()), name="dt")
+    assets = sorted(flows["asset"].unique())
+    actions = [action for action, _, _ in MARS_ACTIONS]
+
+    amounts = (
+        flows.dropna(subset=["action"])
+        .pivot_table(
+            index="dt", columns=["action", "asset"], values="amount", aggfunc="sum"
+        )
+        .reindex(index=index, columns=pd.MultiIndex.from_product([actions, assets]))
+        .fillna(0)
+    )
+    cumulative = amounts.cumsum()
+    prices = (
+        flows.dropna(subset=["price"])
+        .drop_duplicates(subset=["dt", "asset"])
+        .pivot(index="dt", columns="asset", values="price")
+        .reindex(index=index, columns=assets)
+        .to_numpy()
+    )
+
+    deposit_tvl = np.nan_to_num(
+        (cumulative["deposit"] - cumulative["withdraw"]).to_numpy() * prices
+    )
+    borrowed_tvl = np.nan_to_num(
+        (cumulative["borrow"] - cumulative["repay"]).to_numpy() * prices
+    )
+    deposit_total = deposit_tvl.sum(axis=1)
+    borrow_total = borrowed_tvl.sum(axis=1)
+    collateral = deposit_tvl @ np.array([weights.get(a, 0) for a in assets])
+
+    columns = {"dt": index}
+    for action, prefix, _ in MARS_ACTIONS:
+        for a in assets:
+            columns[f"{prefix}_{a}".lower()] = amounts[(action, a)].to_numpy()
+    for a in assets:
+        for action, _, cum in MARS_ACTIONS:
+            columns[f"{cum}_{a}".lower()] = cumulative[(action, a)].to_numpy()
+    for i, a in enumerate(assets):
+        columns[f"{a}_deposit_tvl".lower()] = deposit_tvl[:, i]
+    for i, a in enumerate(assets):
+        columns[f"{a}_borrowed_tvl".lower()] = borrowed_tvl[:, i]
+    columns["deposit_tvl"] = deposit_total
+    columns["borrow_tvl"] = borrow_total
+    columns["total_tvl"] = deposit_total - borrow_total
+    for i, a in enumerate(assets):
+        columns[f"{a}_tvl".lower()] = deposit_tvl[:, i] - borrowed_tvl[:, i]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i, a in enumerate(assets):
+            columns[f"{a}_cap_utilization".lower()] = np.where(
+                deposit_tvl[:, i] == 0, 0, borrowed_tvl[:, i] / deposit_tvl[:, i]
+            )
+        columns["capital_utilization"] = borrow_total / deposit_total
+        columns["system_health_factor"] = np.minimum(
+            collateral / borrow_total, HEALTH_FACTOR_CAP
+        )
+    return pd.DataFrame(columns)
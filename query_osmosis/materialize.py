@@ -0,0 +1,337 @@
+# Locally materialized CTEs
+#
+# A CTE that reads Flipside tables is run upstream on its own, together with
+# the CTEs it depends on, and stored as Parquet under
+# <root>/query_osmosis/cte/c<hash>.parquet, where the hash is taken over its
+# semantic form (queries.semantic_sql). The CTEs that only read other CTEs and
+# the outer query then run in DuckDB over those copies, so any later query that
+# defines the same CTE, in the tutorial or the editor, only pays for the part
+# that differs. A CTE that several stored CTEs depend on is run once and stored
+# too; the others get its rows inlined as VALUES, so it must be small (e.g. the
+# latest date `time` of `staking_share`).
+#
+# A CTE is only materialized once it pays off: when its body has a LIMIT that
+# fits in `max_pages`, or when it has been seen before in the `ttl`-second
+# period its copy would be used in. Copies are only reused within that period,
+# so a dashboard refreshing every `ttl` seconds runs each query once per period
+# and stays on Flipside. Queries whose local part reads anything but CTEs, e.g.
+# `mars_tvl`, whose outer query joins prices, also stay on Flipside. Needs
+# duckdb and sqlglot.
+import collections
+import functools
+import glob
+import hashlib
+import importlib.util
+import os
+import re
+import time
+
+import pandas as pd
+
+from query_osmosis.local import DuckDBProvider, duckdb_available
+from query_osmosis.metrics import count, timed
+from query_osmosis.providers import PAGE_SIZE, ResultTooLarge
+from query_osmosis.queries import semantic_sql
+
+CTE_TTL = 900  # length in seconds of the period a materialized CTE is reused in
+CTE_MAX_PAGES = 5  # CTEs with more rows than this many pages are not stored
+INLINE_ROWS = 1000  # rows of a shared CTE that may be inlined into others
+MAX_SEEN = 10000  # CTEs remembered as seen before
+
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?Z?")
+
+
+# Flipside returns timestamps as strings; store them as timestamps so the
+# local part of a query can use date functions on them
+def _restore_timestamps(df):
+    columns = {}
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        sample = df[column].dropna().head(64)
+        if not sample.empty and all(
+            isinstance(value, str) and _TIMESTAMP.fullmatch(value)
+            for value in sample
+        ):
+            columns[column] = pd.to_datetime(df[column], errors="coerce")
+    return df.assign(**columns) if columns else df
+
+
+def _table_name(table):
+    return ".".join(part for part in (table.catalog, table.db, table.name) if part)
+
+
+# A shared CTE's rows as a VALUES select, or None when there are too many
+def _values(df):
+    if len(df) > INLINE_ROWS:
+        return None
+    from sqlglot import exp
+
+    def literal(value):
+        if value is None or value is pd.NaT or (
+            isinstance(value, float) and value != value
+        ):
+            return exp.null()
+        if isinstance(value, pd.Timestamp):
+            return exp.cast(exp.Literal.string(str(value)), "TIMESTAMP_NTZ")
+        if isinstance(value, bool):
+            return exp.Boolean(this=value)
+        if isinstance(value, (int, float)):
+            return exp.Literal.number(repr(value))
+        return exp.Literal.string(str(value))
+
+    columns = [str(column) for column in df.columns]
+    if df.empty:
+        return exp.select(
+            *[exp.alias_(exp.null(), column) for column in columns]
+        ).where(exp.false())
+    rows = [
+        tuple(literal(value) for value in row)
+        for row in df.astype(object).itertuples(index=False)
+    ]
+    return exp.select("*").from_(exp.values(rows, alias="v", columns=columns))
+
+
+# (local SQL, ((local table, upstream SQL, row limit, inputs), ...)) for a
+# query with CTEs that read Flipside tables, in the order they must be
+# materialized, or None when there is nothing to materialize or the part left
+# to run locally reads anything but CTEs (Flipside tables, table functions).
+# The row limit is the CTE body's own LIMIT, or None. `inputs` are the
+# (CTE name, local table) pairs of shared CTEs, materialized first, whose rows
+# replace their bodies in the upstream SQL (see `inline`).
+@functools.lru_cache(maxsize=256)
+def cte_plan(sql):
+    if importlib.util.find_spec("sqlglot") is None:
+        return None
+    import sqlglot
+    from sqlglot import exp
+
+    try:
+        statements = sqlglot.parse(sql, read="snowflake")
+    except sqlglot.errors.SqlglotError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        return None
+    statement = statements[0]
+    with_ = statement.find(exp.With)
+    if not statement.ctes or with_.args.get("recursive"):
+        return None
+    ctes = {cte.alias_or_name.lower(): cte for cte in statement.ctes}
+
+    # (CTEs, whether anything else: tables or table functions)
+    def reads(node):
+        names, other = set(), False
+        for table in node.find_all(exp.Table):
+            if table.db or not isinstance(table.this, exp.Identifier):
+                other = True
+            elif table.name.lower() in ctes:
+                names.add(table.name.lower())
+        return names, other
+
+    uses = {}
+    upstream = set()
+    for name, cte in ctes.items():
+        uses[name], other = reads(cte.this)
+        if other:
+            upstream.add(name)
+    outer = statement.copy()
+    outer.find(exp.With).pop()
+    outer_uses, other = reads(outer)
+    if other:
+        return None
+
+    # CTEs `name` reads, directly or not, without looking past `boundary`
+    def dependencies(name, boundary=()):
+        seen, pending = set(), list(uses[name])
+        while pending:
+            used = pending.pop()
+            if used not in seen:
+                seen.add(used)
+                if used not in boundary:
+                    pending += uses[used]
+        return seen
+
+    def remote(name):
+        return name in upstream or bool(dependencies(name) & upstream)
+
+    local, units = set(), set()
+    pending = list(outer_uses)
+    while pending:
+        name = pending.pop()
+        if name in upstream:
+            units.add(name)
+        elif name not in local:
+            local.add(name)
+            pending += uses[name]
+    if not units:
+        return None
+
+    # A remote CTE needed by two units becomes a unit of its own, until no two
+    # units would run the same remote CTE upstream
+    while True:
+        needed = collections.Counter(
+            used for name in units for used in dependencies(name, units) - units
+        )
+        shared = {used for used, n in needed.items() if n > 1 and remote(used)}
+        if not shared:
+            break
+        units |= shared
+
+    tables = {}
+    order = [name for name in ctes if name in units]
+    order.sort(key=lambda name: len(dependencies(name) & units))
+    for name in order:
+        body = ctes[name].this.copy()
+        limit = body.args.get("limit")
+        try:
+            rows = int(limit.expression.name) if limit else None
+        except (AttributeError, ValueError):
+            rows = None
+        needed = dependencies(name, units)
+        inputs = tuple(sorted(needed & units))
+        for dependency in ctes:
+            if dependency in inputs:
+                placeholder = exp.select("*").from_(tables[dependency][0])
+                body = body.with_(dependency, as_=placeholder)
+            elif dependency in needed:
+                body = body.with_(dependency, as_=ctes[dependency].this.copy())
+        upstream_sql = body.sql(dialect="snowflake")
+        digest = hashlib.sha1(semantic_sql(upstream_sql).encode()).hexdigest()[:16]
+        tables[name] = (
+            f"query_osmosis.cte.c{digest}",
+            upstream_sql,
+            rows,
+            tuple((dependency, tables[dependency][0]) for dependency in inputs),
+        )
+
+    rewritten = statement.copy()
+    for cte in list(rewritten.ctes):
+        if cte.alias_or_name.lower() not in local:
+            cte.pop()
+    if not rewritten.ctes:
+        rewritten.find(exp.With).pop()
+    for table in list(rewritten.find_all(exp.Table)):
+        name = table.name.lower()
+        if not table.db and name in tables:
+            catalog, db, local_name = tables[name][0].split(".")
+            table.replace(
+                exp.table_(
+                    local_name, db=db, catalog=catalog, alias=table.alias or name
+                )
+            )
+    return rewritten.sql(dialect="snowflake"), tuple(tables[name] for name in order)
+
+
+# `upstream_sql` with the bodies of its input CTEs replaced by their rows
+# (`rows` maps CTE name to DataFrame), or None when one has too many
+def inline(upstream_sql, rows):
+    if not rows:
+        return upstream_sql
+    import sqlglot
+
+    statement = sqlglot.parse_one(upstream_sql, read="snowflake")
+    for cte in statement.ctes:
+        name = cte.alias_or_name.lower()
+        if name in rows:
+            values = _values(rows[name])
+            if values is None:
+                return None
+            cte.set("this", values)
+    return statement.sql(dialect="snowflake")
+
+
+class MaterializingProvider(DuckDBProvider):
+    name = "Materialized"
+
+    # `upstream` runs the CTEs, normally the Flipside provider
+    def __init__(self, root, upstream, ttl=CTE_TTL, max_pages=CTE_MAX_PAGES):
+        super().__init__(root)
+        self.upstream = upstream
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._too_large = set()
+        self._seen = collections.Counter()
+
+    # Covered when every CTE to materialize has a current copy, is bounded by
+    # its own LIMIT or has been seen before in this period; a CTE seen for the
+    # first time leaves the query to Flipside, as does any query a copy made now
+    # would not be reused for
+    def covers(self, sql):
+        if not duckdb_available():
+            return False
+        plan = cte_plan(sql)
+        if plan is None:
+            return False
+        tables = self.tables()
+        period = int(time.time() // self.ttl)
+        covered = True
+        for table, _, rows, _ in plan[1]:
+            if len(self._seen) > MAX_SEEN:
+                self._seen.clear()
+            self._seen[table, period] += 1
+            path = tables.get(table)
+            if table in self._too_large:
+                covered = False
+            elif not (path and self._current(path)):
+                bounded = rows is not None and rows < PAGE_SIZE * self.max_pages
+                covered = covered and (bounded or self._seen[table, period] > 1)
+        return covered
+
+    # Made in the current `ttl`-second period
+    def _current(self, path):
+        try:
+            made = os.path.getmtime(path)
+        except FileNotFoundError:  # pruned by another worker
+            return False
+        return int(made // self.ttl) == int(time.time() // self.ttl)
+
+    # Store every CTE the query needs that is missing or older than `ttl`, and
+    # return the SQL left to run locally. A CTE whose result turns out larger
+    # than `max_pages` is given up on as soon as the upstream says so.
+    def materialize(self, sql):
+        local_sql, ctes = cte_plan(sql)
+        self._prune()
+        tables = self.tables()
+        for table, upstream_sql, _, inputs in ctes:
+            path = tables.get(table)
+            if path and self._current(path):
+                count("query_osmosis_cte_total", result="hit")
+                continue
+            count("query_osmosis_cte_total", result="miss")
+            upstream_sql = inline(
+                upstream_sql,
+                {name: pd.read_parquet(tables[input]) for name, input in inputs},
+            )
+            if upstream_sql is None:
+                self._too_large.add(table)
+                raise ValueError(f"CTE input too large to inline: {table}")
+            max_rows = PAGE_SIZE * self.max_pages - 1
+            try:
+                with timed("materialize", provider=self.upstream.name):
+                    pages = list(
+                        self.upstream.stream(
+                            upstream_sql, max_pages=self.max_pages, max_rows=max_rows
+                        )
+                    )
+                df = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+                if len(df) > max_rows:
+                    raise ResultTooLarge(f"more than {max_rows} rows")
+            except ResultTooLarge:
+                self._too_large.add(table)
+                raise
+            if df.columns.empty:
+                raise ValueError(f"CTE result has no columns: {table}")
+            tables[table] = self.store(table, _restore_timestamps(df))
+        return local_sql
+
+    def _prune(self):
+        pattern = os.path.join(self.root, "query_osmosis", "cte", "*.parquet")
+        for path in glob.glob(pattern):
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def submit(self, sql, page_size=PAGE_SIZE):
+        return super().submit(self.materialize(sql), page_size)
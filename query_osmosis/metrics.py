@@ -0,0 +1,183 @@
+# Process-wide timing metrics, exposed in Prometheus text format
+import contextlib
+import http.server
+import threading
+import time
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            self.last = value
+            self.max = max(self.max, value)
+
+
+# Metrics keyed by (name, sorted label items)
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._help = {}
+
+    def _get(self, kind, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = kind()
+                self._help.setdefault(name, (kind, help))
+            return metric
+
+    def counter(self, name, help="", **labels):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help="", **labels):
+        return self._get(Histogram, name, help, labels)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._metrics.items(), key=lambda item: item[0])
+
+    def exposition(self):
+        lines = []
+        seen = set()
+        for (name, labels), metric in self.items():
+            if name not in seen:
+                seen.add(name)
+                kind, help = self._help[name]
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind.__name__.lower()}")
+            if isinstance(metric, Counter):
+                lines.append(f"{name}{_labels(labels)} {metric.value}")
+                continue
+            for bound, count in zip(metric.buckets, metric.counts):
+                bucket_labels = labels + (("le", f"{bound:g}"),)
+                lines.append(f"{name}_bucket{_labels(bucket_labels)} {count}")
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{name}_bucket{_labels(inf_labels)} {metric.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {metric.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+registry = Registry()
+
+
+# Time a block as a pipeline stage, e.g. `with timed("flipside.page"):`
+@contextlib.contextmanager
+def timed(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.counter(
+            "query_osmosis_stage_errors_total",
+            "Stages that raised",
+            stage=stage,
+            **labels,
+        ).inc()
+        raise
+    finally:
+        registry.histogram(
+            "query_osmosis_stage_seconds",
+            "Wall time per pipeline stage",
+            stage=stage,
+            **labels,
+        ).observe(time.perf_counter() - start)
+
+
+def count(name, amount=1, help="", **labels):
+    registry.counter(name, help, **labels).inc(amount)
+
+
+# Rows for the sidebar debug panel, one per timed stage
+def snapshot():
+    rows = []
+    for (name, labels), metric in registry.items():
+        if name != "query_osmosis_stage_seconds":
+            continue
+        labels = dict(labels)
+        rows.append(
+            {
+                "stage": labels.pop("stage"),
+                "labels": ", ".join(f"{k}={v}" for k, v in labels.items()),
+                "calls": metric.count,
+                "total_s": round(metric.sum, 3),
+                "mean_ms": round(metric.sum / metric.count * 1000, 1),
+                "last_ms": round(metric.last * 1000, 1),
+                "max_ms": round(metric.max * 1000, 1),
+            }
+        )
+    return rows
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Serve /metrics on a daemon thread. Safe to call on every script rerun; returns
+# False when the port is taken, e.g. by another worker on the same host.
+def serve(port, host="127.0.0.1"):
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return True
+        try:
+            _server = http.server.ThreadingHTTPServer((host, port), _Handler)
+        except OSError:
+            return False
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return True
@@ -0,0 +1,139 @@
+# Query providers behind the editor
+#
+# A provider runs SQL in pages: `submit` starts a query and returns a handle,
+# `fetch_page` returns one page of it as a DataFrame, `stream` yields pages until
+# the result is exhausted and `cancel` stops a running query. `schema` lists the
+# tables it can answer as table_catalog/table_schema/table_name/column_name rows
+# and `covers` tells whether it can answer a given query. `total_rows` is the
+# size of a submitted query's result, when the provider knows it up front.
+import re
+
+import pandas as pd
+
+from query_osmosis.interning import address_columns, intern_frame, interned_columns
+from query_osmosis.metrics import count, timed
+
+PAGE_SIZE = 100000
+MAX_PAGES = 10  # max is a million rows @ 100k per page
+
+_TABLE_REFERENCE = re.compile(
+    r"\b(?:from|join)\s+([a-z_][\w$]*\.[a-z_][\w$]*\.[a-z_][\w$]*)", re.I
+)
+
+
+# Fully qualified (database.schema.table) tables a query reads, lower-cased
+def referenced_tables(sql):
+    return {name.lower() for name in _TABLE_REFERENCE.findall(sql)}
+
+
+# A result has more rows than the caller asked to read
+class ResultTooLarge(ValueError):
+    pass
+
+
+class Provider:
+    name = None
+
+    def submit(self, sql, page_size=PAGE_SIZE):
+        raise NotImplementedError
+
+    def fetch_page(self, handle, page_number):
+        raise NotImplementedError
+
+    def cancel(self, handle):
+        pass
+
+    def schema(self):
+        raise NotImplementedError
+
+    def covers(self, sql):
+        return True
+
+    def total_rows(self, handle):
+        return None
+
+    # Pages of `sql`; with `max_rows`, a result the provider knows to be larger
+    # raises ResultTooLarge before any page is read
+    def stream(self, sql, page_size=PAGE_SIZE, max_pages=MAX_PAGES, max_rows=None):
+        handle = self.submit(sql, page_size)
+        try:
+            total = self.total_rows(handle)
+            if max_rows is not None and total is not None and total > max_rows:
+                raise ResultTooLarge(f"{total} rows, more than {max_rows}")
+            for page_number in range(1, max_pages + 1):
+                page = self.fetch_page(handle, page_number)
+                if page.empty:
+                    break
+                yield page
+                if len(page) < page_size:
+                    break
+        finally:
+            self.cancel(handle)
+
+    # Pages with address columns interned, every page encoded like the first.
+    # With `intern=False` pages are passed through as they are, for results
+    # whose strings should not stay in the process-wide dictionary.
+    def pages(self, sql, page_size=PAGE_SIZE, max_pages=MAX_PAGES, intern=True):
+        if not intern:
+            yield from self.stream(sql, page_size, max_pages)
+            return
+        columns = None
+        for page in self.stream(sql, page_size, max_pages):
+            if columns is None:
+                columns = address_columns(page)
+            yield intern_frame(page, columns)
+
+    # All pages as one DataFrame
+    def query(self, sql, page_size=PAGE_SIZE, max_pages=MAX_PAGES, intern=True):
+        pages = list(self.pages(sql, page_size, max_pages, intern))
+        if not pages:
+            return pd.DataFrame()
+        with timed("concat", provider=self.name):
+            df = pd.concat(pages, ignore_index=True)
+        df.attrs["interned"] = interned_columns(pages[0])
+        return df
+
+
+PROVIDERS = {}
+
+
+def register_provider(provider):
+    PROVIDERS[provider.name] = provider
+    return provider
+
+
+# Providers, in registration order, that can answer `sql`. Register local
+# providers before Flipside, which covers everything.
+def covering_providers(sql, providers=None):
+    providers = PROVIDERS if providers is None else providers
+    return [provider for provider in providers.values() if provider.covers(sql)]
+
+
+# Run `q` on the named provider, or with "auto" on the first provider that covers
+# it, falling back to the next one if it fails (e.g. SQL DuckDB cannot run);
+# fallbacks are counted in query_osmosis_provider_fallbacks_total.
+# `collect`, when given, is handed the provider's pages, not interned, instead
+# of them being concatenated in memory (see results.ResultStore.collect).
+def run_query(q, provider="auto", providers=None, collect=None):
+    providers = PROVIDERS if providers is None else providers
+    if provider == "auto":
+        candidates = covering_providers(q, providers)
+        if not candidates:
+            raise LookupError("no provider can answer this query")
+    else:
+        candidates = [providers[provider]]
+    for candidate in candidates:
+        try:
+            with timed("run_query", provider=candidate.name):
+                if collect is not None:
+                    return collect(candidate.pages(q, intern=False))
+                return candidate.query(q)
+        except Exception as exc:
+            if candidate is candidates[-1]:
+                raise
+            count(
+                "query_osmosis_provider_fallbacks_total",
+                help="Queries a provider failed that went to the next one",
+                provider=candidate.name,
+                error=type(exc).__name__,
+            )
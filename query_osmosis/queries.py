@@ -0,0 +1,753 @@
+# Named, parameterized SQL for the tutorial and dashboard sections
+import decimal
+import functools
+import importlib.util
+import re
+
+MARS_RED_BANK = "osmo1c3ljch9dfw5kf52nfwpxd2zmj2ese7agnx0p9tenkrryasrle5sqf3ftpg"
+MARS_ASSETS = ("OSMO", "ATOM", "USDC", "STATOM")
+MARS_LAUNCH = "2023-02-01"  # Mars Outpost on Osmosis; no red bank flows before
+
+# Share of each asset's deposits that counts as collateral in the health factor.
+# Assets without an entry do not count as collateral.
+COLLATERAL_WEIGHTS = {"OSMO": 0.61, "ATOM": 0.7, "USDC": 0.75, "STATOM": 0.55}
+
+
+# Parameter types. `coerce` validates user input, `sql` renders it into a query.
+class Param:
+    def __init__(self, default):
+        self.default = default
+
+    def coerce(self, value):
+        return value
+
+    def sql(self, value):
+        return str(value)
+
+
+class Window(Param):
+    # Trailing window in days, applied as `>= current_date - <days>`
+    def coerce(self, value):
+        days = int(value)
+        if days < 1:
+            raise ValueError(f"window must be at least one day, got {value!r}")
+        return days
+
+
+class BlockHeight(Param):
+    # Block id, applied as `block_id > <since>`
+    def coerce(self, value):
+        height = int(value)
+        if height < 0:
+            raise ValueError(f"block height must not be negative, got {value!r}")
+        return height
+
+
+class RowLimit(Param):
+    def coerce(self, value):
+        rows = int(value)
+        if rows < 1:
+            raise ValueError(f"row limit must be at least one, got {value!r}")
+        return rows
+
+
+class Literal(Param):
+    pattern = r".+"
+
+    def coerce(self, value):
+        value = str(value)
+        if not re.fullmatch(self.pattern, value):
+            raise ValueError(f"invalid {type(self).__name__.lower()}: {value!r}")
+        return value
+
+    def sql(self, value):
+        return f"'{value}'"
+
+
+class Currency(Literal):
+    # Native or IBC denom, e.g. uosmo or ibc/27394FB0...
+    pattern = r"[A-Za-z0-9/]+"
+
+
+class Date(Literal):
+    # ISO date, applied as `>= '<date>'`
+    pattern = r"\d{4}-\d{2}-\d{2}"
+
+
+class Address(Literal):
+    # Bech32 account or contract address on Osmosis
+    pattern = r"osmo1[02-9ac-hj-np-z]+"
+
+
+class AssetList(Param):
+    # Symbols become part of column names in mars_tvl (Deposited_OSMO), so
+    # only letters and digits
+    pattern = r"[A-Z0-9]+"
+
+    def coerce(self, value):
+        if isinstance(value, str):
+            value = value.split(",")
+        assets = tuple(dict.fromkeys(str(a).strip().upper() for a in value))
+        if not assets:
+            raise ValueError("asset list is empty")
+        for asset in assets:
+            if not re.fullmatch(self.pattern, asset):
+                raise ValueError(f"invalid asset symbol: {asset!r}")
+        return assets
+
+    def sql(self, value):
+        return ", ".join(f"'{asset}'" for asset in value)
+
+
+class Query:
+    # `template` is either a str.format template or a function taking the bound
+    # parameters and returning SQL. `window` names the Window parameter and
+    # `partition_column` the result column it filters on, which lets a cached
+    # result for a wider window answer a narrower one.
+    def __init__(self, name, template, params=None, window=None, partition_column=None):
+        self.name = name
+        self.template = template
+        self.params = params or {}
+        self.window = window
+        self.partition_column = partition_column
+
+    def bind(self, **values):
+        unknown = set(values) - set(self.params)
+        if unknown:
+            raise TypeError(f"{self.name} got unknown parameters: {sorted(unknown)}")
+        return {
+            key: param.coerce(values.get(key, param.default))
+            for key, param in self.params.items()
+        }
+
+
+QUERIES = {}
+
+
+def register(query):
+    QUERIES[query.name] = query
+    return query
+
+
+# Render a query and return (sql, canonical form). The canonical form is the
+# result-cache key; both are cached per distinct set of bound parameters.
+def plan(name, **values):
+    query = QUERIES[name]
+    bound = query.bind(**values)
+    return _plan(name, tuple(sorted(bound.items())))
+
+
+def render(name, **values):
+    return plan(name, **values)[0]
+
+
+@functools.lru_cache(maxsize=256)
+def _plan(name, bound):
+    query = QUERIES[name]
+    bound = dict(bound)
+    if callable(query.template):
+        sql = query.template(bound)
+    else:
+        sql = query.template.format(
+            **{key: query.params[key].sql(value) for key, value in bound.items()}
+        )
+    return sql, canonical_sql(sql)
+
+
+_TOKENS = re.compile(
+    r"(?P<string>'(?:[^']|'')*')"
+    r"|(?P<quoted>\"(?:[^\"]|\"\")*\")"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<space>\s+)",
+    re.S,
+)
+
+
+# Whitespace-, comment- and case-insensitive form of a query. String literals and
+# quoted identifiers are kept verbatim, so the result is still executable.
+def canonical_sql(sql):
+    parts = []
+    pos = 0
+    for match in _TOKENS.finditer(sql):
+        if match.start() > pos:
+            parts.append(sql[pos : match.start()].lower())
+        if match.lastgroup in ("string", "quoted"):
+            parts.append(match.group())
+        elif parts and parts[-1] != " ":
+            parts.append(" ")
+        pos = match.end()
+    parts.append(sql[pos:].lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+# Key under which semantically equal queries share a result. The query is
+# parsed with sqlglot (Snowflake dialect); identifiers are case-normalized,
+# numeric literals compared against written in one form, AND/OR operands, IN
+# lists and the two sides of `=` put in a fixed order, and comments dropped. Falls back to
+# canonical_sql when sqlglot is not installed or cannot parse the query.
+@functools.lru_cache(maxsize=1024)
+def semantic_sql(sql):
+    if importlib.util.find_spec("sqlglot") is None:
+        return canonical_sql(sql)
+    import sqlglot
+    from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+
+    try:
+        statements = sqlglot.parse(sql, read="snowflake")
+    except sqlglot.errors.SqlglotError:
+        return canonical_sql(sql)
+    keys = []
+    for statement in statements:
+        if statement is None:
+            continue
+        statement = normalize_identifiers(statement, dialect="snowflake")
+        # Children before parents, so operands are normalized before sorting
+        for node in reversed(list(statement.walk())):
+            replacement = _normalize_node(node)
+            if replacement is not node:
+                if node is statement:
+                    statement = replacement
+                else:
+                    node.replace(replacement)
+        keys.append(_sql_key(statement))
+    return ";\n".join(key for key in keys if key) or canonical_sql(sql)
+
+
+def _sql_key(node):
+    return node.sql(dialect="snowflake", comments=False)
+
+
+# Whether `node` is an operand of a comparison, IN or BETWEEN, where 1.5 and
+# 1.50 mean the same; elsewhere (casts to text, division) they do not
+def _compared(node):
+    from sqlglot import exp
+
+    parent = node.parent
+    while isinstance(parent, (exp.Neg, exp.Paren)):
+        node, parent = parent, parent.parent
+    return isinstance(
+        parent, (exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.In, exp.Between)
+    )
+
+
+def _normalize_node(node):
+    from sqlglot import exp
+
+    if isinstance(node, exp.Literal) and not node.is_string and _compared(node):
+        try:
+            value = decimal.Decimal(node.this)
+        except decimal.InvalidOperation:
+            return node
+        return exp.Literal.number(format(value.normalize(), "f"))
+    if isinstance(node, (exp.And, exp.Or)):
+        connector = type(node)
+        operands = []
+        pending = [node.left, node.right]
+        while pending:
+            operand = pending.pop()
+            if isinstance(operand, exp.Paren):
+                if isinstance(operand.this, connector):
+                    operand = operand.this
+            if isinstance(operand, connector):
+                pending += [operand.left, operand.right]
+            else:
+                operands.append(operand)
+        operands.sort(key=_sql_key)
+        combine = exp.and_ if connector is exp.And else exp.or_
+        return combine(*operands, copy=False)
+    if isinstance(node, exp.In) and node.expressions:
+        node.set("expressions", sorted(node.expressions, key=_sql_key))
+    elif isinstance(node, exp.EQ) and _sql_key(node.left) > _sql_key(node.right):
+        return exp.EQ(this=node.right, expression=node.left)
+    return node
+
+
+register(
+    Query(
+        "transfer_types",
+        """select distinct transfer_type from osmosis.core.fact_transfers
+""",
+    )
+)
+
+register(
+    Query(
+        "ibc_transfers_daily",
+        """select date_trunc('day', block_timestamp) as date,
+    transfer_type,
+    count(distinct tx_id) as num_tx from osmosis.core.fact_transfers a
+    where tx_succeeded = 'TRUE'
+    and  date_trunc('day', block_timestamp) >= current_date - {days}
+    and transfer_type in ('IBC_TRANSFER_IN','IBC_TRANSFER_OUT')
+    group by date, transfer_type
+""",
+        {"days": Window(30)},
+        window="days",
+        partition_column="date",
+    )
+)
+
+register(
+    Query(
+        "staking_daily",
+        """select date_trunc('day', block_timestamp) as date,
+    action,
+    sum(amount/pow(10, decimal)) as total_amount from osmosis.core.fact_staking a
+    where tx_succeeded = 'TRUE'
+    and  date_trunc('day', block_timestamp) >= current_date - {days}
+    and currency = {currency}
+    group by date, action
+""",
+        {"days": Window(30), "currency": Currency("uosmo")},
+        window="days",
+        partition_column="date",
+    )
+)
+
+STAKING_SHARE_SQL = """WITH time as (
+    select
+      max(date_trunc('day', block_timestamp)) as date
+    from
+      osmosis.core.fact_blocks
+  ),
+  delegations as (
+    select
+      date_trunc('day', block_timestamp) as date,
+      delegator_address,
+      validator_address,
+      sum(amount / pow(10, decimal)) as amount
+    from
+      osmosis.core.fact_staking
+    where
+      tx_succeeded = 'TRUE'
+      and action = 'delegate'
+      and date_trunc('day', block_timestamp) <= (
+        select
+          date
+        from
+          time
+      )
+    group by
+      date,
+      delegator_address,
+      validator_address
+  ),
+  undelegations as (
+    select
+      date_trunc('day', block_timestamp) as date,
+      delegator_address,
+      validator_address,
+      sum(amount / pow(10, decimal)) * (-1) as amount
+    from
+      osmosis.core.fact_staking
+    where
+      tx_succeeded = 'TRUE'
+      and action = 'undelegate'
+      and date_trunc('day', block_timestamp) <= (
+        select
+          date
+        from
+          time
+      )
+    group by
+      date,
+      delegator_address,
+      validator_address
+  ),
+  redelegations_to as (
+    select
+      date_trunc('day', block_timestamp) as date,
+      delegator_address,
+      validator_address,
+      sum(amount / pow(10, decimal)) as amount
+    from
+      osmosis.core.fact_staking
+    where
+      tx_succeeded = 'TRUE'
+      and action = 'redelegate'
+      and date_trunc('day', block_timestamp) <= (
+        select
+          date
+        from
+          time
+      )
+    group by
+      date,
+      delegator_address,
+      validator_address
+  ),
+  redelegations_from as (
+    select
+      date_trunc('day', block_timestamp) as date,
+      delegator_address,
+      redelegate_source_validator_address as validator_address,
+      sum(amount / pow(10, decimal)) * (-1) as amount
+    from
+      osmosis.core.fact_staking
+    where
+      tx_succeeded = 'TRUE'
+      and action = 'redelegate'
+      and date_trunc('day', block_timestamp) <= (
+        select
+          date
+        from
+          time
+      )
+    group by
+      date,
+      delegator_address,
+      redelegate_source_validator_address
+  ),
+  total_staked_user_1 as (
+    select
+      delegator_address,
+      b.total_amount,
+      sum(amount) as amount_delegated_user,
+      amount_delegated_user / b.total_amount * 100 as percentage_over_total,
+      rank() over (
+        order by
+          percentage_over_total desc
+      ) as rank
+    from
+      (
+        select
+          *
+        from
+          delegations
+        union all
+        select
+          *
+        from
+          undelegations
+        union all
+        select
+          *
+        from
+          redelegations_to
+        union all
+        select
+          *
+        from
+          redelegations_from
+      ) a
+      join (
+        select
+          sum(amount) as total_amount
+        from
+          (
+            select
+              *
+            from
+              delegations
+            union all
+            select
+              *
+            from
+              undelegations
+            union all
+            select
+              *
+            from
+              redelegations_to
+            union all
+            select
+              *
+            from
+              redelegations_from
+          )
+      ) b
+    group by
+      1,
+      2
+    order by
+      percentage_over_total desc
+  )
+select * from total_staked_user_1
+limit 20
+"""
+
+register(Query("staking_share", STAKING_SHARE_SQL))
+
+# Raw staking events after a block, in block order, for the local delegation
+# ledger (query_osmosis/staking.py) that answers `staking_share` incrementally
+register(
+    Query(
+        "staking_events",
+        """select
+  block_id,
+  action,
+  delegator_address,
+  validator_address,
+  redelegate_source_validator_address,
+  amount / pow(10, decimal) as amount
+from
+  osmosis.core.fact_staking
+where
+  tx_succeeded = 'TRUE'
+  and action in ('delegate', 'undelegate', 'redelegate')
+  and block_id > {since}
+order by
+  block_id
+limit {limit}
+""",
+        {"since": BlockHeight(0), "limit": RowLimit(500000)},
+    )
+)
+
+# Flows in and out of the Mars red bank, one row per (hour, tx, action, asset)
+MARS_FLOWS_SQL = """with txs as (
+select
+distinct a.tx_id,
+a.msg_group,
+action
+from (
+select
+tx_id,
+msg_group,
+attribute_value as action
+from osmosis.core.fact_msg_attributes
+where attribute_key = 'action' and
+(attribute_value = 'borrow' or attribute_value = 'deposit' or attribute_value = 'withdraw' or attribute_value = 'repay'
+)) a
+left join osmosis.core.fact_msg_attributes b
+on a.tx_id = b.tx_id
+where b.attribute_key = '_contract_address' and b.attribute_value = {contract_address}
+),
+
+asset_flows as (
+
+select distinct *
+
+from (
+
+select
+date_trunc('hour',a.block_timestamp) as dt,
+a.tx_id,
+b.action,
+d.token as asset,
+a.amount/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount{amount_usd}
+from (
+select
+block_timestamp,
+tx_id,
+msg_group,
+attribute_value as amount
+from osmosis.core.fact_msg_attributes
+where msg_type = 'wasm' and attribute_key = 'amount_scaled'
+) a
+join txs b
+on a.tx_id = b.tx_id and a.msg_group = b.msg_group
+join (
+select
+tx_id,
+msg_group,
+attribute_value as denom
+from osmosis.core.fact_msg_attributes
+where msg_type = 'wasm-interests_updated' and attribute_key = 'denom'
+) c
+on a.tx_id = c.tx_id and a.msg_group = c.msg_group
+join (
+select
+address,
+upper(project_name) as token,
+decimal
+from osmosis.core.dim_tokens
+where upper(project_name) in ({assets})
+) d
+on c.denom = d.address
+join (
+select
+tx_id,
+msg_group,
+attribute_value as liquidity_index
+from osmosis.core.fact_msg_attributes
+where msg_type = 'wasm-interests_updated' and attribute_key = 'liquidity_index'
+) f
+on a.tx_id = f.tx_id and a.msg_group = f.msg_group{price_join}
+)
+)"""
+
+# The USD amount and hourly price join of the original query. The long-format
+# `mars_flows` leaves them out and takes prices from its own `prices` CTE.
+MARS_AMOUNT_USD = """,
+a.amount*e.price/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount_usd"""
+MARS_PRICE_JOIN = """
+join (
+select
+recorded_hour,
+symbol,
+price
+from osmosis.core.ez_prices
+) e
+on d.token = e.symbol and date_trunc('hour',a.block_timestamp) = e.recorded_hour
+where e.recorded_hour is not null"""
+
+# (action, flow column prefix, cumulative column prefix)
+MARS_ACTIONS = (
+    ("deposit", "Deposited", "Cum_Deposit"),
+    ("borrow", "Borrowed", "Cum_Borrowed"),
+    ("withdraw", "Withdrawn", "Cum_Withdrawn"),
+    ("repay", "Repaid", "Cum_Repaid"),
+)
+
+
+def _mars_flows(bound, prices=True):
+    return MARS_FLOWS_SQL.format(
+        contract_address=Address(None).sql(bound["contract_address"]),
+        assets=AssetList(None).sql(bound["assets"]),
+        amount_usd=MARS_AMOUNT_USD if prices else "",
+        price_join=MARS_PRICE_JOIN if prices else "",
+    )
+
+
+# The Effort Capital Mars TVL query, with one set of columns per asset
+def _mars_tvl(bound):
+    assets = bound["assets"]
+    flows = [
+        f"  sum(coalesce(case when action = '{action}' and asset = '{a}' then amount end,0)) as {prefix}_{a}"
+        for action, prefix, _ in MARS_ACTIONS
+        for a in assets
+    ]
+    cumulative = [
+        f"  SUM({prefix}_{a}) over (order by dt asc) as {cum}_{a}"
+        for a in assets
+        for _, prefix, cum in MARS_ACTIONS
+    ]
+    deposit = [f"{a}_Deposit_TVL" for a in assets]
+    borrowed = [f"{a}_Borrowed_TVL" for a in assets]
+    collateral = "+".join(
+        f"({a}_Deposit_TVL*{COLLATERAL_WEIGHTS.get(a, 0):g})" for a in assets
+    )
+    tvl = (
+        [
+            f"coalesce((cum_deposit_{a}-cum_withdrawn_{a})*{a}_price,0) as {a}_Deposit_TVL"
+            for a in assets
+        ]
+        + [
+            f"coalesce((cum_borrowed_{a}-cum_repaid_{a})*{a}_price,0) as {a}_Borrowed_TVL"
+            for a in assets
+        ]
+        + [
+            f"{'+'.join(deposit)} as Deposit_TVL",
+            f"{'+'.join(borrowed)} as Borrow_TVL",
+            "Deposit_TVL - Borrow_TVL as Total_TVL",
+        ]
+        + [f"{a}_Deposit_TVL-{a}_Borrowed_TVL as {a}_TVL" for a in assets]
+        + [
+            f"case when {a}_Deposit_TVL=0 then 0 else {a}_Borrowed_TVL/{a}_Deposit_TVL end as {a}_Cap_Utilization"
+            for a in assets
+        ]
+        + [
+            "Borrow_TVL/Deposit_TVL as Capital_Utilization",
+            f"case when (({collateral})/borrow_tvl) > 10 then 10\n"
+            f"else (({collateral})/borrow_tvl) end as system_health_factor",
+        ]
+    )
+    prices = [
+        f"""left join (
+select
+recorded_hour as dt,
+price as {a}_Price
+from osmosis.core.ez_prices
+where symbol = '{a}'
+) p{i}
+on a.dt = p{i}.dt"""
+        for i, a in enumerate(assets)
+    ]
+    summarized = ",\n".join(flows + cumulative)
+    selected = ",\n".join(tvl)
+    joins = "\n".join(prices)
+    return f"""{_mars_flows(bound)},
+
+summarized_flows as (
+
+select
+  dt,
+{summarized}
+from asset_flows
+group by 1
+order by 1 asc
+
+)
+
+select
+a.*,
+{selected}
+from summarized_flows a
+{joins}
+order by dt asc
+"""
+
+
+register(
+    Query(
+        "mars_tvl",
+        _mars_tvl,
+        {"contract_address": Address(MARS_RED_BANK), "assets": AssetList(MARS_ASSETS)},
+    )
+)
+
+
+# Long-format Mars flows: one row per (hour, asset) with that hour's price and,
+# when the asset moved in that hour, the summed amount per action. Pivoting,
+# cumulative sums and TVL happen locally in query_osmosis.mars, so adding an
+# asset does not add columns or price joins on the Snowflake side.
+def _mars_flows_long(bound):
+    return f"""{_mars_flows(bound, prices=False)},
+
+prices as (
+select
+recorded_hour as dt,
+symbol as asset,
+price
+from osmosis.core.ez_prices
+where symbol in ({AssetList(None).sql(bound["assets"])})
+and recorded_hour >= {Date(None).sql(bound["since"])}
+),
+
+hourly_flows as (
+select
+f.dt,
+f.action,
+f.asset,
+sum(f.amount) as amount
+from asset_flows f
+join prices p
+on f.asset = p.asset and f.dt = p.dt
+group by 1, 2, 3
+),
+
+grid as (
+select
+h.dt,
+t.asset
+from (select distinct dt from hourly_flows) h
+cross join (select distinct asset from hourly_flows) t
+)
+
+select
+g.dt,
+g.asset,
+f.action,
+coalesce(f.amount, 0) as amount,
+p.price
+from grid g
+left join hourly_flows f
+on g.dt = f.dt and g.asset = f.asset
+left join prices p
+on g.asset = p.asset and g.dt = p.dt
+order by 1 asc
+"""
+
+
+register(
+    Query(
+        "mars_flows",
+        _mars_flows_long,
+        {
+            "contract_address": Address(MARS_RED_BANK),
+            "assets": AssetList(MARS_ASSETS),
+            "since": Date(MARS_LAUNCH),
+        },
+    )
+)
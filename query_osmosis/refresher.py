@@ -0,0 +1,96 @@
+# Dashboard datasets reloaded in the background
+#
+# Each dataset is a function returning a DataFrame. It is loaded on first use
+# and then reloaded every `interval` seconds by a daemon thread, never by a
+# script run. A dataset's version is a hash of its content, so it only changes
+# when a reload returns different data, and it is the same in every process
+# holding the same data, which makes it safe in shared cache keys.
+import hashlib
+import threading
+import uuid
+
+import pandas as pd
+
+from query_osmosis.interning import decode_frame
+from query_osmosis.metrics import count, timed
+
+REFRESH_INTERVAL = 900  # seconds
+
+
+# Content hash of a frame, or a random one when it holds unhashable values
+# (lists, dicts) and every reload has to count as a change. Interned columns
+# are hashed as strings, since codes differ between processes.
+def _digest(df):
+    df = decode_frame(df)
+    try:
+        hashes = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        return uuid.uuid4().hex[:16]
+    digest = hashlib.sha1(repr((list(df.columns), list(map(str, df.dtypes)))).encode())
+    digest.update(hashes.to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class Refresher:
+    def __init__(self, interval=REFRESH_INTERVAL):
+        self.interval = interval
+        self._loaders = {}
+        self._locks = {}
+        self._data = {}  # name -> (version, DataFrame)
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, name, load):
+        with self._lock:
+            self._loaders[name] = load
+            self._locks[name] = threading.Lock()
+
+    # (version, DataFrame) of `name`, loaded in the calling thread the first
+    # time it is asked for
+    def get(self, name):
+        data = self._data.get(name)
+        if data is None:
+            with self._locks[name]:
+                data = self._data.get(name) or self._load(name)
+        return data
+
+    def version(self, name):
+        return self.get(name)[0]
+
+    def refresh(self, name):
+        with self._locks[name]:
+            return self._load(name)
+
+    def _load(self, name):
+        with timed("refresh", dataset=name):
+            df = self._loaders[name]()
+        version = _digest(df)
+        previous = self._data.get(name)
+        count(
+            "query_osmosis_refresh_total",
+            dataset=name,
+            result="unchanged" if previous and version == previous[0] else "changed",
+        )
+        data = self._data[name] = (version, df)
+        return data
+
+    # Reload every dataset that has been used every `interval` seconds
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="query_osmosis-refresher", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for name in list(self._data):
+                try:
+                    self.refresh(name)
+                except Exception:
+                    count("query_osmosis_refresh_total", dataset=name, result="error")
@@ -0,0 +1,263 @@
+# Editor results kept within per-session and global memory budgets
+#
+# Results are stored per query key (queries.semantic_sql) and shared by every
+# browser session that asks for the same key. A result that grows past
+# `spill_threshold` while it is fetched is written to Arrow IPC files page by
+# page instead of being concatenated in memory, and whole results are spilled,
+# least recently used first, when a session or all sessions together go over
+# their budget. Spilled results are read back through memory maps, so
+# only the rows that are displayed are materialized. Past `disk_budget` the
+# least recently used spilled results are deleted. Results older than `ttl`
+# are dropped on the next lookup, so queries over recent data are rerun.
+#
+# Address and hash columns are kept as categoricals local to each result, and
+# spilled as Arrow dictionary columns, rather than as codes into the
+# process-wide interner: their strings are counted against the budgets and
+# freed with the result.
+import collections
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+
+from query_osmosis.interning import address_columns, interner
+from query_osmosis.metrics import count, timed
+
+MB = 1 << 20
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class Result:
+    def __init__(self, directory):
+        self.directory = directory
+        self.created = time.time()
+        self.rows = 0
+        self.nbytes = 0  # held in memory, 0 once spilled
+        self.disk_bytes = 0
+        self.categorical = None  # address columns, found in the first page
+        self.sessions = set()  # browser sessions using this result
+        self._pages = []
+        self._tables = []  # memory-mapped, one per spilled page
+        self._paths = []
+        self._lock = threading.Lock()
+
+    @property
+    def spilled(self):
+        return bool(self._paths)
+
+    def add(self, page):
+        with self._lock:
+            if self.categorical is None:
+                self.categorical = address_columns(page)
+            if self.categorical:
+                page = page.assign(
+                    **{c: page[c].astype("category") for c in self.categorical}
+                )
+            self.rows += len(page)
+            if self._paths:
+                self._write(page)
+            else:
+                self._pages.append(page)
+                self.nbytes += frame_bytes(page)
+
+    def _write(self, page):
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}.arrow")
+        table = pa.Table.from_pandas(page, preserve_index=False)
+        # one index type for every page, so spilled pages concatenate
+        for i, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                dictionary = pa.dictionary(pa.int32(), field.type.value_type)
+                table = table.set_column(i, field.name, table[i].cast(dictionary))
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        self._paths.append(path)
+        self._tables.append(pa.ipc.open_file(pa.memory_map(path)).read_all())
+        self.disk_bytes += os.path.getsize(path)
+
+    # Move the pages held in memory to disk
+    def spill(self):
+        with self._lock:
+            if not self._pages:
+                return
+            with timed("results.spill"):
+                for page in self._pages:
+                    self._write(page)
+            self._pages = []
+            self.nbytes = 0
+
+    # The first `n` rows as a DataFrame, read from the memory map when spilled
+    def head(self, n):
+        with self._lock:
+            pages, tables = list(self._pages), list(self._tables)
+        parts = []
+        rows = 0
+        for part in tables or pages:
+            if rows >= n:
+                break
+            part = part.slice(0, n - rows) if tables else part.iloc[: n - rows]
+            parts.append(part)
+            rows += len(part)
+        if not parts:
+            df = pd.DataFrame()
+        elif tables:
+            df = pa.concat_tables(parts, promote_options="permissive").to_pandas()
+        else:
+            df = pd.concat(parts, ignore_index=True)
+        return df
+
+    def delete(self):
+        with self._lock:
+            for path in self._paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._pages, self._tables, self._paths = [], [], []
+            self.nbytes = self.disk_bytes = 0
+
+
+class ResultStore:
+    # Budgets are in bytes and `ttl` in seconds. `directory` defaults to a
+    # temporary directory that is removed with the store.
+    def __init__(
+        self,
+        directory=None,
+        session_budget=256 * MB,
+        memory_budget=1024 * MB,
+        spill_threshold=64 * MB,
+        disk_budget=10240 * MB,
+        ttl=600,
+    ):
+        if directory is None:
+            self._tempdir = tempfile.TemporaryDirectory(prefix="query_osmosis_")
+            directory = self._tempdir.name
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.session_budget = session_budget
+        self.memory_budget = memory_budget
+        self.spill_threshold = min(spill_threshold, session_budget)
+        self.disk_budget = disk_budget
+        self.ttl = ttl
+        self._results = collections.OrderedDict()  # least recently used first
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._enforce_lock = threading.Lock()
+
+    # The stored result for `key`, whichever session fetched it, or None when
+    # there is none younger than `ttl`
+    def get(self, session, key):
+        expired = None
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and time.time() - result.created > self.ttl:
+                expired = self._results.pop(key)
+                result = None
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                result.sessions.add(session)
+                self._results.move_to_end(key)
+        if expired is not None:
+            count("query_osmosis_results_total", event="expire")
+            expired.delete()
+        count("query_osmosis_results_total", event="miss" if result is None else "hit")
+        return result
+
+    # Forget the sessions `is_active(session)` says have ended, so results no
+    # longer count against their budgets
+    def forget_sessions(self, is_active):
+        with self._lock:
+            for result in self._results.values():
+                result.sessions = {s for s in result.sessions if is_active(s)}
+
+    # Build the result for `key` from `pages`, e.g. Provider.pages
+    def collect(self, session, key, pages):
+        result = Result(self.directory)
+        result.sessions.add(session)
+        try:
+            for page in pages:
+                result.add(page)
+                if result.nbytes > self.spill_threshold:
+                    count("query_osmosis_results_total", event="spill")
+                    result.spill()
+        except BaseException:
+            result.delete()
+            raise
+        with self._lock:
+            previous = self._results.pop(key, None)
+            self._results[key] = result
+        if previous is not None:
+            previous.delete()
+        self._enforce(session)
+        return result
+
+    def usage(self):
+        with self._lock:
+            results = list(self._results.values())
+            lookups = self.hits + self.misses
+            hit_rate = self.hits / lookups if lookups else None
+        return {
+            "results": len(results),
+            "memory_bytes": sum(r.nbytes for r in results),
+            "disk_bytes": sum(r.disk_bytes for r in results),
+            "hit_rate": hit_rate,
+            "interned_strings": len(interner),
+        }
+
+    def _enforce(self, session):
+        with self._enforce_lock:
+            with self._lock:
+                entries = list(self._results.items())
+            # A shared result counts against every session using it
+            used = sum(r.nbytes for _, r in entries if session in r.sessions)
+            for _, result in entries:
+                if used <= self.session_budget:
+                    break
+                if session in result.sessions and result.nbytes:
+                    used -= result.nbytes
+                    count("query_osmosis_results_total", event="spill")
+                    result.spill()
+            used = sum(r.nbytes for _, r in entries)
+            for _, result in entries:
+                if used <= self.memory_budget:
+                    break
+                if result.nbytes:
+                    used -= result.nbytes
+                    count("query_osmosis_results_total", event="spill")
+                    result.spill()
+            used = sum(r.disk_bytes for _, r in entries)
+            for item, result in entries:
+                if used <= self.disk_budget:
+                    break
+                if result.disk_bytes:
+                    used -= result.disk_bytes
+                    with self._lock:
+                        self._results.pop(item, None)
+                    count("query_osmosis_results_total", event="evict")
+                    result.delete()
+
+
+# RESULT_SPILL_DIR, the RESULT_*_MB budgets and RESULT_TTL_S, with the defaults
+# above
+def result_store_from_env():
+    def budget(name, default):
+        return int(float(os.environ.get(name, default)) * MB)
+
+    return ResultStore(
+        os.environ.get("RESULT_SPILL_DIR"),
+        session_budget=budget("RESULT_SESSION_MB", 256),
+        memory_budget=budget("RESULT_MEMORY_MB", 1024),
+        spill_threshold=budget("RESULT_SPILL_MB", 64),
+        disk_budget=budget("RESULT_DISK_MB", 10240),
+        ttl=float(os.environ.get("RESULT_TTL_S", 600)),
+    )
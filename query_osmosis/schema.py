@@ -0,0 +1,23 @@
+# Table listings for the schema sidebar
+import pandas as pd
+
+
+# One (table_name, qualified name, columns) tuple per table in `table_schema`,
+# sorted by table name. `columns` is a one-column DataFrame for st.table.
+def schema_tables(schema_df, table_schema):
+    provider_schema_df = schema_df[schema_df["table_schema"] == table_schema]
+    tables = []
+    for table_name, table_df in provider_schema_df.groupby("table_name", sort=True):
+        table_catalog = table_df["table_catalog"].iloc[0]
+        if pd.notna(table_catalog):
+            table_catalog = f"{table_catalog}."
+        else:
+            table_catalog = ""
+        tables.append(
+            (
+                table_name,
+                f"{table_catalog}{table_schema}.{table_name}",
+                table_df[["column_name"]],
+            )
+        )
+    return tables
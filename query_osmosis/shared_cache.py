@@ -0,0 +1,248 @@
+# Result and figure cache shared by every Streamlit worker on a host
+#
+# SHARED_CACHE_URL selects the backend: sqlite:///path/to/cache.db (WAL mode)
+# or redis://host:6379/0 (any server speaking the Redis protocol; needs the
+# redis package). DataFrames are stored as Arrow IPC streams. A cross-process
+# lock per key makes sure one worker fills a missing entry while the others
+# wait for it instead of running the same query; `lock` holds one around any
+# other work the workers should do one at a time.
+import contextlib
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+import pyarrow as pa
+
+from query_osmosis.interning import NULL, interned_columns, interner
+from query_osmosis.metrics import count
+
+LOCK_TTL = 600  # seconds a filler may hold a key before others take over
+POLL_INTERVAL = 0.2
+PURGE_INTERVAL = 300  # seconds between deletes of expired SQLite rows
+
+
+# Interned columns are written as Arrow dictionary arrays holding only the
+# strings the frame uses, so the payload is compact and valid in any process.
+def frame_to_ipc(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in interned_columns(df):
+        codes = df[column].to_numpy()
+        null = codes == NULL
+        used, indices = np.unique(codes[~null], return_inverse=True)
+        local_codes = np.zeros(len(codes), dtype=np.int32)
+        local_codes[~null] = indices
+        array = pa.DictionaryArray.from_arrays(
+            pa.array(local_codes, mask=null),
+            pa.array(interner.decode(used), type=pa.string()),
+        )
+        table = table.set_column(table.schema.get_field_index(column), column, array)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+# Dictionary columns come back interned into this process's dictionary
+def ipc_to_frame(payload):
+    table = pa.ipc.open_stream(payload).read_all()
+    columns = [f.name for f in table.schema if pa.types.is_dictionary(f.type)]
+    df = table.to_pandas()
+    for column in columns:
+        local_codes = df[column].cat.codes.to_numpy()
+        codes = interner.encode(df[column].cat.categories)
+        if not len(codes):  # only nulls
+            df[column] = np.full(len(df), NULL, dtype=np.int32)
+            continue
+        df[column] = np.where(local_codes < 0, NULL, codes[local_codes]).astype(
+            np.int32
+        )
+    if columns:
+        df.attrs["interned"] = columns
+    return df
+
+
+# Expired rows are deleted every PURGE_INTERVAL seconds by whichever worker
+# writes next, and the WAL file is truncated back to 64 MB after checkpoints.
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._next_purge = 0
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("pragma journal_mode=wal")
+            db.execute("pragma synchronous=normal")
+            db.execute(f"pragma journal_size_limit={64 << 20}")
+            db.execute(
+                "create table if not exists entries"
+                " (key text primary key, value blob, expires real)"
+            )
+            db.execute(
+                "create table if not exists locks"
+                " (key text primary key, token text, expires real)"
+            )
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        row = self._db().execute(
+            "select value from entries"
+            " where key = ? and (expires is null or expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else time.time() + ttl
+        self._db().execute(
+            "insert or replace into entries values (?, ?, ?)", (key, value, expires)
+        )
+        if time.time() > self._next_purge:
+            self._next_purge = time.time() + PURGE_INTERVAL
+            self.purge()
+
+    def purge(self):
+        db = self._db()
+        now = time.time()
+        db.execute("delete from entries where expires < ?", (now,))
+        db.execute("delete from locks where expires < ?", (now,))
+
+    def acquire(self, key, ttl=LOCK_TTL):
+        token = uuid.uuid4().hex
+        db = self._db()
+        db.execute("begin immediate")
+        try:
+            db.execute(
+                "delete from locks where key = ? and expires < ?", (key, time.time())
+            )
+            inserted = db.execute(
+                "insert or ignore into locks values (?, ?, ?)",
+                (key, token, time.time() + ttl),
+            ).rowcount
+            db.execute("commit")
+        except BaseException:
+            db.execute("rollback")
+            raise
+        return token if inserted else None
+
+    def release(self, key, token):
+        self._db().execute(
+            "delete from locks where key = ? and token = ?", (key, token)
+        )
+
+
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=None if ttl is None else int(ttl))
+
+    def acquire(self, key, ttl=LOCK_TTL):
+        token = uuid.uuid4().hex
+        if self.client.set(f"lock:{key}", token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+
+    def release(self, key, token):
+        self.client.eval(_RELEASE, 1, f"lock:{key}", token)
+
+
+class SharedCache:
+    # `backend` is None when no shared cache is configured; every call then
+    # just runs `fill`.
+    def __init__(self, backend=None, namespace="query_osmosis:"):
+        self.backend = backend
+        self.namespace = namespace
+
+    def get_or_fill(self, key, fill, ttl=None, wait=LOCK_TTL):
+        if self.backend is None:
+            return fill()
+        key = self.namespace + hashlib.sha1(key.encode()).hexdigest()
+        value = self.backend.get(key)
+        if value is not None:
+            count("query_osmosis_shared_cache_total", result="hit")
+            return value
+        deadline = time.monotonic() + wait
+        while True:
+            token = self.backend.acquire(key)
+            if token is not None:
+                try:
+                    value = self.backend.get(key)
+                    if value is None:
+                        count("query_osmosis_shared_cache_total", result="fill")
+                        value = fill()
+                        self.backend.set(key, value, ttl)
+                    return value
+                finally:
+                    self.backend.release(key, token)
+            time.sleep(POLL_INTERVAL)
+            value = self.backend.get(key)
+            if value is not None:
+                count("query_osmosis_shared_cache_total", result="waited")
+                return value
+            if time.monotonic() > deadline:
+                return fill()
+
+    # Hold the cross-process lock on `key` for a `with` block, waiting up to
+    # `wait` seconds for another worker to release it. A holder that takes
+    # longer than `ttl` seconds loses it. Does nothing without a backend.
+    @contextlib.contextmanager
+    def lock(self, key, ttl=LOCK_TTL, wait=LOCK_TTL):
+        if self.backend is None:
+            yield
+            return
+        key = self.namespace + hashlib.sha1(f"lock:{key}".encode()).hexdigest()
+        deadline = time.monotonic() + wait
+        token = self.backend.acquire(key, ttl)
+        while token is None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"lock held by another worker: {key}")
+            time.sleep(POLL_INTERVAL)
+            token = self.backend.acquire(key, ttl)
+        try:
+            yield
+        finally:
+            self.backend.release(key, token)
+
+    def frame(self, key, fill, ttl=None):
+        if self.backend is None:
+            return fill()
+        return ipc_to_frame(
+            self.get_or_fill(f"frame:{key}", lambda: frame_to_ipc(fill()), ttl)
+        )
+
+
+def open_shared_cache(url):
+    if not url:
+        return SharedCache()
+    if url.startswith("sqlite:///"):
+        return SharedCache(SQLiteBackend(url[len("sqlite:///") :]))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return SharedCache(RedisBackend(url))
+    raise ValueError(f"unsupported SHARED_CACHE_URL: {url}")
+
+
+def shared_cache_from_env():
+    return open_shared_cache(os.environ.get("SHARED_CACHE_URL"))
@@ -0,0 +1,277 @@
+# Local delegation ledger behind the `staking_share` ranking
+#
+# `staking_share` rebuilds every delegator's position from the whole of
+# osmosis.core.fact_staking. The ledger ingests those events once and then
+# only the events after the last block it has seen (`cursor`), keeping a
+# (delegator, validator) -> balance map and per-delegator totals in numpy
+# arrays keyed by interned address codes. Top-N shares and single-address ranks
+# are then answered from memory. `start` keeps the ledger current from a
+# background thread, so no page view waits for the first ingestion. Workers
+# sharing a snapshot path and a lock (shared_cache.SharedCache.lock) take turns:
+# one fetches and saves, the others load its snapshot instead of fetching.
+import contextlib
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from query_osmosis.interning import NULL, interned_columns, interner
+from query_osmosis.metrics import count, timed
+from query_osmosis.queries import QUERIES, render
+
+SIGNS = {"delegate": 1.0, "undelegate": -1.0, "redelegate": 1.0}
+COLUMNS = [
+    "delegator_address",
+    "total_amount",
+    "amount_delegated_user",
+    "percentage_over_total",
+    "rank",
+]
+
+
+# Interner codes of an event column, whether or not the provider interned it
+def _codes(events, column):
+    if column in interned_columns(events):
+        return events[column].to_numpy(dtype=np.int32)
+    return interner.encode(events[column])
+
+
+# Add `deltas` (a Series indexed by key) into `values`, aligned with `index`;
+# unseen keys are appended. Returns the new (index, values).
+def _accumulate(index, values, deltas):
+    position = index.get_indexer(deltas.index)
+    new = position < 0
+    if new.any():
+        index = index.append(deltas.index[new])
+        values = np.concatenate([values, np.zeros(new.sum())])
+        position[new] = np.arange(len(values) - new.sum(), len(values))
+    values[position] += deltas.to_numpy()
+    return index, values
+
+
+class StakingLedger:
+    def __init__(self):
+        self.cursor = 0  # last block id applied
+        self.updated = None  # time.time() of the last refresh
+        self._pairs = pd.Index([], dtype=np.int64)
+        self._balances = np.zeros(0)
+        self._delegators = pd.Index([], dtype=np.int32)
+        self._totals = np.zeros(0)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._snapshot = None  # mtime of the snapshot last saved or loaded
+
+    def __len__(self):
+        return len(self._delegators)
+
+    # Apply a batch of `staking_events` rows. A redelegation moves the amount
+    # from redelegate_source_validator_address to validator_address.
+    def apply(self, events):
+        if events.empty:
+            return
+        delegator = _codes(events, "delegator_address")
+        validator = _codes(events, "validator_address")
+        source = _codes(events, "redelegate_source_validator_address")
+        action = events["action"].to_numpy()
+        amount = pd.to_numeric(events["amount"]).fillna(0).to_numpy(dtype=float)
+        sign = pd.Series(action).map(SIGNS).fillna(0).to_numpy()
+        moved = action == "redelegate"
+
+        delegators = np.concatenate([delegator, delegator[moved]])
+        validators = np.concatenate([validator, source[moved]])
+        deltas = np.concatenate([sign * amount, -amount[moved]])
+        keys = (delegators.astype(np.int64) << 32) | (
+            validators.astype(np.int64) & 0xFFFFFFFF
+        )
+        pair_deltas = pd.Series(deltas).groupby(keys).sum()
+        delegator_deltas = pd.Series(deltas).groupby(delegators).sum()
+        with self._lock:
+            self._pairs, self._balances = _accumulate(
+                self._pairs, self._balances, pair_deltas
+            )
+            self._delegators, self._totals = _accumulate(
+                self._delegators, self._totals, delegator_deltas
+            )
+            last = int(pd.to_numeric(events["block_id"]).max())
+            self.cursor = max(self.cursor, last)
+
+    # Pull and apply the events after `cursor` through `fetch(sql)` (e.g.
+    # providers.run_query). A full batch may end mid-block, so its last block is
+    # left for the next batch. With `max_age`, a caller that waited for another
+    # refresh returns without fetching again when that one made the ledger
+    # current. Returns whether it fetched.
+    def refresh(self, fetch, limit=None, max_age=None):
+        limit = limit or QUERIES["staking_events"].params["limit"].default
+        with self._refresh_lock:
+            if max_age is not None and not self.stale(max_age):
+                return False
+            while True:
+                with timed("staking.fetch"):
+                    sql = render("staking_events", since=self.cursor, limit=limit)
+                    events = fetch(sql)
+                if len(events) < limit:
+                    with timed("staking.apply"):
+                        self.apply(events)
+                    break
+                blocks = pd.to_numeric(events["block_id"])
+                complete = events[blocks < blocks.max()]
+                if complete.empty:
+                    raise ValueError(f"block {blocks.max()} has over {limit} events")
+                with timed("staking.apply"):
+                    self.apply(complete)
+            self.updated = time.time()
+        return True
+
+    def stale(self, max_age):
+        return self.updated is None or time.time() - self.updated > max_age
+
+    # Refresh now and then every `interval` seconds on a daemon thread, saving
+    # a snapshot to `path` after each refresh that fetched. `lock` returns a
+    # context manager held around each turn, e.g. a SharedCache.lock; in it the
+    # ledger first loads a newer snapshot saved by another worker.
+    def start(self, fetch, interval, path=None, lock=contextlib.nullcontext):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(fetch, interval, path, lock),
+                name="query_osmosis-staking",
+                daemon=True,
+            )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, fetch, interval, path, lock):
+        while True:
+            try:
+                with lock():
+                    if path:
+                        self.reload(path)
+                    if self.refresh(fetch, max_age=interval) and path:
+                        self.save(path)
+            except Exception:
+                count("query_osmosis_refresh_total", dataset="staking", result="error")
+            if self._stop.wait(interval):
+                return
+
+    # The `staking_share` columns for the `n` largest delegators, ranked like
+    # SQL rank() over the share. delegator_address holds interner codes.
+    def top(self, n=20):
+        with self._lock:
+            totals = self._totals
+            n = min(int(n), len(totals))
+            order = np.argpartition(-totals, n - 1)[:n] if n else np.empty(0, int)
+            order = order[np.argsort(-totals[order], kind="stable")]
+            amounts = totals[order]
+            delegators = self._delegators.to_numpy()[order]
+            total = totals.sum()
+        df = pd.DataFrame(
+            {
+                "delegator_address": delegators,
+                "total_amount": total,
+                "amount_delegated_user": amounts,
+                "percentage_over_total": amounts / total * 100,
+            },
+            columns=COLUMNS[:-1],
+        )
+        # Everything ranked above a top-N row is itself in the top N
+        df["rank"] = (
+            df["percentage_over_total"].rank(method="min", ascending=False).astype(int)
+        )
+        df.attrs["interned"] = ["delegator_address"]
+        return df
+
+    # Share and rank of one delegator, or None when it has no staking events
+    def rank(self, address):
+        code = interner.code(address)
+        with self._lock:
+            i = self._delegators.get_indexer([code])[0] if code != NULL else -1
+            if i < 0:
+                return None
+            amount = self._totals[i]
+            rank = int((self._totals > amount).sum()) + 1
+            total = self._totals.sum()
+        return dict(
+            zip(COLUMNS, [address, total, amount, amount / total * 100, rank])
+        )
+
+    # Balance per validator for one delegator, with validator_address decoded
+    def positions(self, address):
+        code = interner.code(address)
+        with self._lock:
+            pairs = self._pairs.to_numpy()
+            mine = (pairs >> 32) == code if code != NULL else np.zeros(len(pairs), bool)
+            validators = (pairs[mine] & 0xFFFFFFFF).astype(np.uint32).view(np.int32)
+            balances = self._balances[mine]
+        return pd.DataFrame(
+            {"validator_address": interner.decode(validators), "amount": balances}
+        ).sort_values("amount", ascending=False, ignore_index=True)
+
+    # Snapshot of the balance map as Parquet, with the cursor in its metadata
+    def save(self, path):
+        import pyarrow.parquet as pq
+
+        with self._lock:
+            pairs = self._pairs.to_numpy()
+            balances = self._balances.copy()
+            cursor = self.cursor
+        validators = (pairs & 0xFFFFFFFF).astype(np.uint32).view(np.int32)
+        table = pa.table(
+            {
+                "delegator_address": interner.decode(pairs >> 32),
+                "validator_address": interner.decode(validators),
+                "balance": balances,
+            }
+        ).replace_schema_metadata({"cursor": str(cursor)})
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"  # workers may save at once
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+        self._snapshot = os.path.getmtime(path)
+
+    # A ledger restored from `save`, as of the snapshot's mtime, or an empty
+    # one when there is no snapshot
+    @classmethod
+    def load(cls, path):
+        ledger = cls()
+        ledger.reload(path)
+        return ledger
+
+    # Replace the balances with the snapshot at `path` when it is not the one
+    # this ledger last saved or loaded. Returns whether it did.
+    def reload(self, path):
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return False
+        if mtime == self._snapshot:
+            return False
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        df = table.to_pandas()
+        delegators = interner.encode(df["delegator_address"])
+        validators = interner.encode(df["validator_address"])
+        keys = (delegators.astype(np.int64) << 32) | (
+            validators.astype(np.int64) & 0xFFFFFFFF
+        )
+        balances = pd.Series(df["balance"].to_numpy()).groupby(keys).sum()
+        totals = pd.Series(df["balance"].to_numpy()).groupby(delegators).sum()
+        with self._lock:
+            self._pairs = balances.index
+            self._balances = balances.to_numpy(dtype=float, copy=True)
+            self._delegators = totals.index
+            self._totals = totals.to_numpy(dtype=float, copy=True)
+            self.cursor = int(table.schema.metadata[b"cursor"])
+            self.updated = mtime
+            self._snapshot = mtime
+        return True
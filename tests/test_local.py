@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+from query_osmosis.local import DuckDBProvider, duckdb_available
+from query_osmosis.providers import run_query
+
+pytestmark = pytest.mark.skipif(not duckdb_available(), reason="needs duckdb")
+
+
+@pytest.fixture
+def provider(tmp_path):
+    provider = DuckDBProvider(str(tmp_path / "data"))
+    provider.store("osmosis.core.dim_tokens", pd.DataFrame({"address": ["a", "b"]}))
+    return provider
+
+
+@pytest.fixture
+def secret(tmp_path):
+    path = tmp_path / "secrets.toml"
+    path.write_text('API_KEY = "secret"\nother,column\n')
+    return str(path)
+
+
+def test_reads_local_tables(provider):
+    assert provider.covers("select * from osmosis.core.dim_tokens")
+    df = provider.query("select count(*) as n from osmosis.core.dim_tokens")
+    assert df["n"].tolist() == [2]
+
+
+@pytest.mark.parametrize("function", ["read_text", "read_csv", "read_blob"])
+def test_other_files_cannot_be_read(provider, secret, function):
+    sql = (
+        "select t.address, f.* from osmosis.core.dim_tokens t,"
+        f" {function}('{secret}') f"
+    )
+    assert provider.covers(sql)
+    with pytest.raises(Exception, match="disabled by configuration"):
+        provider.query(sql)
+
+
+def test_settings_are_locked(provider):
+    con = provider._connect("select * from osmosis.core.dim_tokens")
+    with pytest.raises(Exception, match="locked"):
+        con.execute("set enable_external_access = true")
+
+
+def test_file_reads_do_not_fall_back_to_a_result(provider, secret):
+    sql = f"select * from osmosis.core.dim_tokens, read_text('{secret}')"
+    with pytest.raises(Exception, match="disabled by configuration"):
+        run_query(sql, providers={provider.name: provider})
+
+
+def test_long_queries_are_interrupted(tmp_path):
+    provider = DuckDBProvider(str(tmp_path / "data"), timeout=0.2)
+    provider.store("osmosis.core.dim_tokens", pd.DataFrame({"address": ["a"]}))
+    sql = (
+        "select count(*) from osmosis.core.dim_tokens,"
+        " range(100000000000) a, range(10) b where a.range % 7 = b.range"
+    )
+    with pytest.raises(TimeoutError):
+        provider.query(sql)
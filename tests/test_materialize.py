@@ -0,0 +1,117 @@
+import importlib.util
+
+import pytest
+
+from query_osmosis.fake import FakeShroomDK, synthetic_records
+from query_osmosis.flipside import FlipsideProvider
+from query_osmosis.local import duckdb_available
+from query_osmosis.materialize import MaterializingProvider, cte_plan
+from query_osmosis.providers import ResultTooLarge, run_query
+from query_osmosis.queries import render
+
+pytestmark = pytest.mark.skipif(
+    not duckdb_available() or importlib.util.find_spec("sqlglot") is None,
+    reason="needs duckdb and sqlglot",
+)
+
+UNBOUNDED = (
+    "with t as (select * from osmosis.core.fact_transfers)"
+    " select currency, count(*) as n from t group by 1"
+)
+
+
+def test_mars_flows_runs_each_cte_once():
+    _, ctes = cte_plan(render("mars_flows"))
+    upstream = [sql.lower() for _, sql, _, _ in ctes]
+    assert len(upstream) == 2
+    assert sum("fact_msg_attributes" in sql for sql in upstream) == 1
+
+
+def test_shared_ctes_are_materialized_once():
+    _, ctes = cte_plan(render("staking_share"))
+    upstream = [sql.lower() for _, sql, _, _ in ctes]
+    assert len(upstream) == 5
+    assert sum("fact_blocks" in sql for sql in upstream) == 1
+    time_table = ctes[0][0]
+    assert all(inputs == (("time", time_table),) for *_, inputs in ctes[1:])
+
+
+def test_shared_cte_rows_are_inlined(tmp_path):
+    sql = (
+        "with latest as (select max(block_id) as b from osmosis.core.fact_blocks),"
+        " a as (select * from osmosis.core.fact_transfers, latest where block_id < b),"
+        " c as (select * from osmosis.core.fact_staking, latest where block_id < b)"
+        " select count(*) as n from a join c using (block_id)"
+    )
+    queries = []
+
+    def default(sql):
+        queries.append(sql)
+        return [{"b": 7}] if "fact_blocks" in sql else [{"block_id": 1}]
+
+    sdk = FakeShroomDK(default=default)
+    provider = MaterializingProvider(str(tmp_path), FlipsideProvider(sdk=sdk))
+    assert not provider.covers(sql)
+    assert provider.covers(sql)
+    assert provider.query(sql)["n"].tolist() == [1]
+    assert sdk.calls == 3
+    assert sum("VALUES (7)" in query for query in queries) == 2
+
+
+def test_unbounded_cte_is_materialized_when_seen_again(tmp_path):
+    sdk = FakeShroomDK(default=lambda sql: synthetic_records(1000, seed=sql))
+    provider = MaterializingProvider(str(tmp_path), FlipsideProvider(sdk=sdk))
+    assert not provider.covers(UNBOUNDED)
+    assert provider.covers(UNBOUNDED)
+    provider.query(UNBOUNDED)
+    calls = sdk.calls
+    assert provider.covers(UNBOUNDED)
+    assert provider.query(UNBOUNDED)["n"].sum() == 1000
+    assert sdk.calls == calls
+
+
+def test_bounded_cte_is_materialized_at_once(tmp_path):
+    sql = (
+        "with t as (select * from osmosis.core.fact_transfers limit 100)"
+        " select count(*) as n from t"
+    )
+    provider = MaterializingProvider(str(tmp_path), FlipsideProvider(FakeShroomDK()))
+    assert provider.covers(sql)
+
+
+def test_dashboard_refreshes_stay_upstream(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("query_osmosis.materialize.time.time", lambda: now[0])
+    provider = MaterializingProvider(str(tmp_path), FlipsideProvider(FakeShroomDK()))
+    for _ in range(3):
+        assert not provider.covers(UNBOUNDED)
+        now[0] += provider.ttl
+
+
+def test_too_large_cte_stops_at_the_first_page(tmp_path, monkeypatch):
+    monkeypatch.setattr(FlipsideProvider, "total_rows", lambda self, handle: 10**6)
+    sdk = FakeShroomDK()
+    provider = MaterializingProvider(str(tmp_path), FlipsideProvider(sdk=sdk))
+    provider.covers(UNBOUNDED)
+    assert provider.covers(UNBOUNDED)
+    with pytest.raises(ResultTooLarge):
+        provider.query(UNBOUNDED)
+    assert sdk.calls == 1
+    assert not provider.covers(UNBOUNDED)
+
+
+def test_local_part_cannot_read_files(tmp_path):
+    secret = tmp_path / "secrets.toml"
+    secret.write_text('API_KEY = "secret"\n')
+    sql = (
+        "with t as (select * from osmosis.core.fact_transfers limit 1)"
+        f" select * from t, read_text('{secret}')"
+    )
+    assert cte_plan(sql) is None
+    sdk = FakeShroomDK(default=lambda sql: synthetic_records(1, seed=sql))
+    flipside = FlipsideProvider(sdk=sdk)
+    provider = MaterializingProvider(str(tmp_path), flipside)
+    assert not provider.covers(sql)
+    providers = {provider.name: provider, flipside.name: flipside}
+    df = run_query(sql, providers=providers)
+    assert "secret" not in df.to_string()
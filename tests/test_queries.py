@@ -0,0 +1,19 @@
+import importlib.util
+
+import pytest
+
+from query_osmosis.queries import render
+
+
+@pytest.mark.parametrize("assets", ["USDC.AXL", "OSMO,ST-ATOM", "OSMO,"])
+def test_asset_symbols_must_be_identifiers(assets):
+    with pytest.raises(ValueError):
+        render("mars_tvl", assets=assets)
+
+
+@pytest.mark.skipif(importlib.util.find_spec("sqlglot") is None, reason="needs sqlglot")
+def test_mars_tvl_parses_for_any_valid_asset_list():
+    import sqlglot
+
+    sql = render("mars_tvl", assets="osmo,atom,usdc,statom,juno2")
+    assert sqlglot.parse_one(sql, read="snowflake").find(sqlglot.exp.Select)
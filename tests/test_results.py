@@ -0,0 +1,109 @@
+import os
+
+import pandas as pd
+import pytest
+
+from query_osmosis.fake import synthetic_records
+from query_osmosis.results import ResultStore, frame_bytes
+
+PAGE = pd.DataFrame(synthetic_records(2000, seed=1))
+PAGE_BYTES = frame_bytes(PAGE)
+
+
+def _pages(n):
+    return [PAGE] * n
+
+
+def _store(tmp_path, **budgets):
+    return ResultStore(str(tmp_path / "spill"), **budgets)
+
+
+def test_small_result_stays_in_memory(tmp_path):
+    store = _store(tmp_path)
+    result = store.collect("s1", "q", _pages(2))
+    assert not result.spilled
+    assert result.rows == 2 * len(PAGE)
+    assert store.get("s2", "q") is result
+    head = result.head(10).astype(PAGE.dtypes.to_dict())
+    pd.testing.assert_frame_equal(head, PAGE.head(10))
+
+
+def test_result_spills_past_the_threshold(tmp_path):
+    store = _store(tmp_path, spill_threshold=PAGE_BYTES)
+    result = store.collect("s1", "q", _pages(3))
+    assert result.spilled
+    assert result.nbytes == 0 and result.disk_bytes > 0
+    assert result.rows == 3 * len(PAGE)
+    head = result.head(len(PAGE) + 10)
+    assert len(head) == len(PAGE) + 10
+    assert list(head["tx_id"][:10]) == list(PAGE["tx_id"][:10])
+
+
+def test_session_budget_spills_that_sessions_oldest_result(tmp_path):
+    store = _store(tmp_path, session_budget=int(2.5 * PAGE_BYTES))
+    other = store.collect("s2", "other", _pages(1))
+    first = store.collect("s1", "a", _pages(1))
+    second = store.collect("s1", "b", _pages(1))
+    assert not first.spilled and not second.spilled
+    third = store.collect("s1", "c", _pages(1))
+    assert first.spilled
+    assert not second.spilled and not third.spilled
+    assert not other.spilled
+
+
+def test_memory_budget_spills_across_sessions(tmp_path):
+    store = _store(tmp_path, memory_budget=int(2.5 * PAGE_BYTES))
+    results = [store.collect(f"s{i}", f"q{i}", _pages(1)) for i in range(3)]
+    assert [r.spilled for r in results] == [True, False, False]
+    assert store.usage()["memory_bytes"] <= store.memory_budget
+
+
+def test_disk_budget_evicts_least_recently_used(tmp_path):
+    store = _store(tmp_path, spill_threshold=PAGE_BYTES // 2)
+    first = store.collect("s1", "a", _pages(1))
+    store.disk_budget = int(1.5 * first.disk_bytes)
+    paths = list(first._paths)
+    store.get("s1", "a")
+    second = store.collect("s1", "b", _pages(1))
+    assert second.spilled
+    assert store.get("s1", "a") is None
+    assert not any(os.path.exists(path) for path in paths)
+    assert store.get("s1", "b") is second
+
+
+def test_expired_results_are_dropped(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("query_osmosis.results.time.time", lambda: now[0])
+    store = _store(tmp_path, spill_threshold=PAGE_BYTES // 2, ttl=60)
+    result = store.collect("s1", "q", _pages(1))
+    paths = list(result._paths)
+    now[0] += 30
+    assert store.get("s1", "q") is result
+    now[0] += 31
+    assert store.get("s1", "q") is None
+    assert not any(os.path.exists(path) for path in paths)
+    assert store.usage()["results"] == 0
+
+
+def test_forgotten_sessions_stop_counting(tmp_path):
+    store = _store(tmp_path, session_budget=int(1.5 * PAGE_BYTES))
+    shared = store.collect("s1", "q", _pages(1))
+    store.get("s2", "q")
+    assert shared.sessions == {"s1", "s2"}
+    store.forget_sessions(lambda session: session == "s2")
+    assert shared.sessions == {"s2"}
+    store.collect("s1", "other", _pages(1))
+    assert not shared.spilled
+
+
+def test_failed_collect_leaves_nothing_behind(tmp_path):
+    store = _store(tmp_path, spill_threshold=PAGE_BYTES // 2)
+
+    def pages():
+        yield PAGE
+        raise RuntimeError("page 2 failed")
+
+    with pytest.raises(RuntimeError):
+        store.collect("s1", "q", pages())
+    assert store.get("s1", "q") is None
+    assert os.listdir(store.directory) == []
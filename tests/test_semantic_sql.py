@@ -0,0 +1,66 @@
+import importlib.util
+
+import pytest
+
+from query_osmosis.queries import semantic_sql
+
+pytestmark = pytest.mark.skipif(
+    importlib.util.find_spec("sqlglot") is None, reason="needs sqlglot"
+)
+
+# Editor results are shared across sessions on semantic_sql, so each pair here
+# must get the same key...
+SAME = [
+    (
+        "select * from osmosis.core.fact_transfers limit 10",
+        "SELECT * FROM Osmosis.Core.Fact_Transfers LIMIT 10;",
+    ),
+    ("select a from t -- only a\nwhere x = 1", "/* a */ select a from t where x=1"),
+    ("select a from t where x = 1 and y = 2", "select a from t where y = 2 and x = 1"),
+    ("select a from t where x = 1 or y = 2", "select a from t where y = 2 or x = 1"),
+    (
+        "select a from t where (x = 1 and y = 2) and z = 3",
+        "select a from t where x = 1 and (z = 3 and y = 2)",
+    ),
+    ("select a from t where x in (1, 2, 3)", "select a from t where x in (3, 1, 2)"),
+    ("select a from t where x = 'd'", "select a from t where 'd' = x"),
+    ("select a from t where x = 1.0", "select a from t where x = 1"),
+    ("select a from t where x in (1.50, 2)", "select a from t where x in (2, 1.5)"),
+    (
+        "select a from t where x between 1.0 and -2.50",
+        "select a from t where x between 1 and -2.5",
+    ),
+]
+
+# ...and each pair here different keys
+DIFFERENT = [
+    ('select "A" from t', 'select "a" from t'),
+    ('select a from "T"', "select a from t"),
+    ("select a - b from t", "select b - a from t"),
+    ("select a / b from t", "select b / a from t"),
+    ("select a from t where x < y", "select a from t where y < x"),
+    ("select a from t where a or b and c", "select a from t where (a or b) and c"),
+    ("select a from t where (a and b) or c", "select a from t where a and (b or c)"),
+    ("select v:Key from t", "select v:key from t"),
+    ("select v:Key::string from t", "select v:key::string from t"),
+    ("select a from t where x = 'A'", "select a from t where x = 'a'"),
+    ("select '-- a' from t", "select '' from t"),
+    ("select concat(a, b) from t", "select concat(b, a) from t"),
+    ("select a from t order by a, b", "select a from t order by b, a"),
+    ("select a from t limit 10", "select a from t limit 100"),
+    ("select a from t where x in (1, 2)", "select a from t where x in (1, 2, 3)"),
+    ("select 1.50::varchar", "select 1.5::varchar"),
+    ("select 1.0/3 from t", "select 1/3 from t"),
+    ("select a from t where x like 1.50", "select a from t where x like 1.5"),
+    ("select a from t where x = 1.0/3", "select a from t where x = 1/3"),
+]
+
+
+@pytest.mark.parametrize("a, b", SAME)
+def test_same_key(a, b):
+    assert semantic_sql(a) == semantic_sql(b)
+
+
+@pytest.mark.parametrize("a, b", DIFFERENT)
+def test_different_key(a, b):
+    assert semantic_sql(a) != semantic_sql(b)
@@ -0,0 +1,110 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from query_osmosis.fake import staking_event_records
+from query_osmosis.interning import decode_frame
+from query_osmosis.local import DuckDBProvider, duckdb_available
+from query_osmosis.queries import render
+from query_osmosis.shared_cache import SharedCache, SQLiteBackend
+from query_osmosis.staking import StakingLedger
+
+pytestmark = pytest.mark.skipif(not duckdb_available(), reason="needs duckdb")
+
+
+# fact_staking and fact_blocks holding `events`, one block per 10 minutes
+def _tables(tmp_path, events):
+    local = DuckDBProvider(str(tmp_path))
+    timestamps = pd.Timestamp("2023-01-01") + pd.to_timedelta(
+        events["block_id"] * 10, unit="min"
+    )
+    local.store(
+        "osmosis.core.fact_staking",
+        events.assign(block_timestamp=timestamps, tx_succeeded="TRUE", decimal=0),
+    )
+    local.store(
+        "osmosis.core.fact_blocks",
+        pd.DataFrame({"block_id": events["block_id"], "block_timestamp": timestamps}),
+    )
+    return local
+
+
+def test_top_matches_staking_share(tmp_path):
+    events = pd.DataFrame(staking_event_records(20000, delegators=2000, seed=1))
+    local = _tables(tmp_path, events)
+    expected = decode_frame(local.query(render("staking_share")))
+
+    ledger = StakingLedger()
+    ledger.apply(events)
+    top = decode_frame(ledger.top(20))
+
+    assert list(top["delegator_address"]) == list(expected["delegator_address"])
+    assert list(top["rank"]) == list(expected["rank"])
+    np.testing.assert_allclose(
+        top["amount_delegated_user"], expected["amount_delegated_user"]
+    )
+    np.testing.assert_allclose(
+        top["percentage_over_total"], expected["percentage_over_total"]
+    )
+
+
+def test_rank_matches_top(tmp_path):
+    events = pd.DataFrame(staking_event_records(5000, delegators=500, seed=2))
+    ledger = StakingLedger()
+    ledger.apply(events)
+    top = decode_frame(ledger.top(5))
+    for row in top.itertuples():
+        assert ledger.rank(row.delegator_address)["rank"] == row.rank
+
+
+def test_refresh_in_batches_and_snapshot(tmp_path):
+    events = pd.DataFrame(staking_event_records(5000, delegators=500, seed=3))
+    whole = StakingLedger()
+    whole.apply(events)
+
+    def fetch(sql):
+        since = int(sql.split("block_id >")[1].split()[0])
+        limit = int(sql.rsplit("limit", 1)[1])
+        return events[events["block_id"] > since].head(limit)
+
+    ledger = StakingLedger()
+    assert ledger.refresh(fetch, limit=700)
+    assert ledger.cursor == events["block_id"].max()
+    assert not ledger.refresh(fetch, limit=700, max_age=60)
+
+    path = str(tmp_path / "ledger.parquet")
+    ledger.save(path)
+    restored = StakingLedger.load(path)
+    assert not restored.stale(60)
+    pd.testing.assert_frame_equal(
+        decode_frame(restored.top(20)), decode_frame(whole.top(20))
+    )
+
+
+def test_workers_sharing_a_lock_read_events_once(tmp_path):
+    events = pd.DataFrame(staking_event_records(2000, delegators=200, seed=4))
+    reads = []
+
+    def fetch(sql):
+        since = int(sql.split("block_id >")[1].split()[0])
+        reads.append(since)
+        time.sleep(0.3)
+        return events[events["block_id"] > since]
+
+    cache = SharedCache(SQLiteBackend(str(tmp_path / "cache.db")))
+    path = str(tmp_path / "ledger.parquet")
+    ledgers = [StakingLedger.load(path) for _ in range(2)]
+    for ledger in ledgers:
+        ledger.start(fetch, 600, path, lock=lambda: cache.lock("staking", wait=10))
+    deadline = time.monotonic() + 10
+    while any(ledger.updated is None for ledger in ledgers):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    for ledger in ledgers:
+        ledger.stop()
+    assert reads == [0]
+    pd.testing.assert_frame_equal(
+        decode_frame(ledgers[0].top(20)), decode_frame(ledgers[1].top(20))
+    )